@@ -0,0 +1,227 @@
+import asyncio
+import time
+from collections import deque
+from batching import PacketBatcher
+from chat_compression import DICTIONARIES
+from client_stream import ClientStream, max_packet
+
+# asyncio client for bots and services, the protocol is ClientStream, this runs it on the event loop:
+# one datagram endpoint, one loop timer for retransmits, delayed acks, keepalives and batches, no threads
+# send() waits while the window is full instead of queueing without limit, so a fast producer is held
+# to what the server acks, and messages() hands out what the server sends as an async iterator
+# after a reset from the server the stream logs in and joins again by itself, a send() that was waiting
+# for the window then returns, its message is resent with the rest
+#
+#     client = await AsyncChatClient("127.0.0.1", 5000).connect()
+#     await client.login("bot")
+#     await client.join("room")
+#     await client.say("room", "hello")
+#     async for message in client.messages("room"):
+#         print(message.sender, message.text)
+# messages kept for the first messages() iterator when they come in before anyone is listening
+backlog_size = 10000
+
+# one line from the server, "[room] user: text" or "[Server] text", room is None for server notices
+class ChatMessage:
+    __slots__ = ("raw", "room", "sender", "text")
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.room = None
+        self.sender = None
+        self.text = raw
+        tag, found, rest = raw[1:].partition("] ")
+        if not raw.startswith("[") or not found:
+            return
+        if tag == "Server":
+            self.sender = "Server"
+            self.text = rest
+            return
+        self.room = tag
+        sender, found, text = rest.partition(": ")
+        if found:
+            self.sender = sender
+            self.text = text
+        else:
+            self.text = rest
+
+    def __str__(self):
+        return self.raw
+
+    def __repr__(self):
+        return f"ChatMessage({self.raw!r})"
+
+class AsyncChatClient(asyncio.DatagramProtocol):
+    def __init__(self, server_ip, server_port, batch_delay=0, compression=True):
+        self.server_address = (server_ip, server_port)
+        self.stream = ClientStream(list(DICTIONARIES) if compression else [])
+        self.transport = None
+        self.loop = None
+        self.closed = False
+        # one send at a time queues its message, so a fast producer waits for the window instead of piling up
+        self.send_lock = asyncio.Lock()
+        # set whenever an ack may have made room, senders waiting on a full window check again
+        self.window_open = asyncio.Event()
+        # set while nothing is waiting for an ack
+        self.idle = asyncio.Event()
+        self.idle.set()
+        # (room or None, queue) for every running messages() iterator
+        self.subscribers = []
+        self.backlog = deque(maxlen=backlog_size)
+        # with a batch delay packets to the server are coalesced into one datagram
+        self.batcher = PacketBatcher(batch_delay, max_packet) if batch_delay > 0 else None
+        # the one loop timer and when it fires
+        self.timer = None
+        self.timer_deadline = None
+# opens the udp endpoint, returns the client so it can be awaited in one line
+    async def connect(self):
+        self.loop = asyncio.get_running_loop()
+        await self.loop.create_datagram_endpoint(lambda: self, local_addr=("0.0.0.0", 0))
+        return self
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.arm_timer(self.stream.next_deadline())
+
+    def connection_lost(self, exc):
+        self.shut_down()
+
+    def error_received(self, exc):
+        print("[Client] Socket error:", exc)
+# sends what the stream gave us, through the batcher when batching is on, and keeps the events and timer current
+    def transmit(self, packets):
+        for packet in packets:
+            if self.batcher is None:
+                self.transport.sendto(packet, self.server_address)
+            elif self.batcher.send(self.transport, self.server_address, packet):
+                self.arm_timer(time.time() + self.batcher.flush_delay)
+        if self.stream.drained():
+            self.idle.set()
+        else:
+            self.idle.clear()
+        self.arm_timer(self.stream.next_deadline())
+# sends a message, waits while the window is full, returns once every packet of it is on the wire
+# it is not acked yet at that point, drain() waits for that
+    async def send(self, message):
+        async with self.send_lock:
+            if self.closed:
+                raise ConnectionError("client is closed")
+            stream = self.stream
+            epoch = stream.epoch
+            entry = stream.queue(message)
+            self.transmit(stream.pump(time.time()))
+            while entry[0] is None:
+                self.window_open.clear()
+                await self.window_open.wait()
+                if self.closed:
+                    raise ConnectionError("client is closed")
+                if stream.epoch != epoch:
+                    # a reset came in, it queued this whole message again
+                    return
+# waits until the server has acked everything sent so far
+    async def drain(self):
+        await self.idle.wait()
+
+    async def login(self, username):
+        await self.send(self.stream.login_line(username))
+
+    async def join(self, room_name):
+        await self.send(f"JOIN {room_name}")
+
+    async def leave(self, room_name):
+        await self.send(f"LEAVE {room_name}")
+
+    async def say(self, room_name, text):
+        await self.send(f"MSG {room_name} {text}")
+# waits up to timeout for everything to be acked and up to timeout again for room to send QUIT, then closes
+# the endpoint whatever happened, QUIT is not waited for, the server drops the session before it would ack it
+    async def close(self, timeout=5.0):
+        if self.closed:
+            return
+        try:
+            await asyncio.wait_for(self.drain(), timeout)
+            # QUIT waits for window room like any message, a server that stopped acking must not hold up the close
+            await asyncio.wait_for(self.send("QUIT"), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            if self.batcher is not None:
+                self.batcher.flush(self.transport, self.server_address)
+            self.transport.close()
+            self.shut_down()
+# stops the timer and wakes everyone waiting on the client
+    def shut_down(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.window_open.set()
+        self.idle.set()
+        for _, queue in self.subscribers:
+            queue.put_nowait(None)
+# async iterator over messages from the server, only the ones for room_name when it is given
+# every iterator gets its own copy, messages that came in while nobody was iterating go to the first one
+    async def messages(self, room_name=None):
+        queue = asyncio.Queue()
+        if not self.subscribers:
+            for message in self.backlog:
+                if room_name is None or message.room == room_name:
+                    queue.put_nowait(message)
+            self.backlog.clear()
+        if self.closed:
+            queue.put_nowait(None)
+        entry = (room_name, queue)
+        self.subscribers.append(entry)
+        try:
+            while True:
+                message = await queue.get()
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.subscribers.remove(entry)
+# hands one line from the server to the iterators that want it, or to the backlog while there are none
+    def deliver_message(self, line):
+        message = ChatMessage(line)
+        if not self.subscribers:
+            self.backlog.append(message)
+            return
+        for room_name, queue in self.subscribers:
+            if room_name is None or room_name == message.room:
+                queue.put_nowait(message)
+
+    def datagram_received(self, data, addr):
+        if self.closed:
+            return
+        packets, lines = self.stream.receive(data, time.time())
+        self.transmit(packets)
+        # an ack or a reset may have made room, or moved a waiting message out
+        self.window_open.set()
+        for line in lines:
+            self.deliver_message(line)
+# moves the loop timer up when deadline is sooner than the one it is set for
+    def arm_timer(self, deadline):
+        if self.closed or self.loop is None:
+            return
+        if self.timer is not None:
+            if self.timer_deadline <= deadline:
+                return
+            self.timer.cancel()
+        self.timer_deadline = deadline
+        self.timer = self.loop.call_later(max(0.0, deadline - time.time()), self.on_timer)
+# everything that runs on a deadline: the streams timers and the batches
+    def on_timer(self):
+        self.timer = None
+        current_time = time.time()
+        packets = self.stream.on_timer(current_time)
+        if packets:
+            # a retransmit may have shrunk the window, senders look again on the next ack
+            self.transmit(packets)
+        if self.batcher is not None:
+            self.batcher.flush_expired(self.transport)
+        deadline = self.stream.next_deadline()
+        if self.batcher is not None:
+            deadline = current_time + self.batcher.time_until_next(current_time, deadline - current_time)
+        self.arm_timer(deadline)
@@ -0,0 +1,74 @@
+import threading
+import time
+from retransmit_scheduler import RetransmitScheduler
+from chat_protocol import create_batch_packet, HEADER_SIZE
+
+# nagle style coalescing: packets for the same peer are held for up to flush_delay seconds
+# and go out as one batch datagram of at most max_size bytes
+class PacketBatcher:
+    def __init__(self, flush_delay, max_size):
+        self.flush_delay = flush_delay
+        self.max_size = max_size
+        # peer address -> [list of packets, batch size so far]
+        self.pending = {}
+        self.flush_timers = RetransmitScheduler()
+        self.lock = threading.Lock()
+        self.datagrams_sent = 0
+        self.packets_batched = 0
+# queues a packet for the peer, returns True when this armed a new flush timer so the caller can wake its timer loop
+    def send(self, sock, peer_addr, packet):
+        size = len(packet)
+        if size + HEADER_SIZE > self.max_size:
+            self.flush(sock, peer_addr)
+            sock.sendto(packet, peer_addr)
+            self.datagrams_sent += 1
+            self.packets_batched += 1
+            return False
+        full = None
+        armed = False
+        with self.lock:
+            entry = self.pending.get(peer_addr)
+            if entry is not None and entry[1] + size > self.max_size:
+                full = self.pending.pop(peer_addr)[0]
+                entry = None
+            if entry is None:
+                # the buffer may hold a bytearray that gets rewritten, so keep a copy
+                self.pending[peer_addr] = [[bytes(packet)], HEADER_SIZE + size]
+                if peer_addr not in self.flush_timers:
+                    self.flush_timers.schedule(peer_addr, time.time() + self.flush_delay)
+                    armed = True
+            else:
+                entry[0].append(bytes(packet))
+                entry[1] += size
+        if full is not None:
+            self.transmit(sock, peer_addr, full)
+        return armed
+# sends whatever is buffered for one peer right now
+    def flush(self, sock, peer_addr):
+        with self.lock:
+            entry = self.pending.pop(peer_addr, None)
+            self.flush_timers.cancel(peer_addr)
+        if entry is not None:
+            self.transmit(sock, peer_addr, entry[0])
+# sends every batch whose delay ran out
+    def flush_expired(self, sock):
+        batches = []
+        with self.lock:
+            for peer_addr in self.flush_timers.pop_expired(time.time()):
+                entry = self.pending.pop(peer_addr, None)
+                if entry is not None:
+                    batches.append((peer_addr, entry[0]))
+        for peer_addr, packets in batches:
+            self.transmit(sock, peer_addr, packets)
+# how long a timer loop can sleep before the next batch is due
+    def time_until_next(self, now, max_wait):
+        with self.lock:
+            return self.flush_timers.time_until_next(now, max_wait)
+# a lone packet goes out as is, no point paying for the batch header
+    def transmit(self, sock, peer_addr, packets):
+        if len(packets) == 1:
+            sock.sendto(packets[0], peer_addr)
+        else:
+            sock.sendto(create_batch_packet(packets), peer_addr)
+        self.datagrams_sent += 1
+        self.packets_batched += len(packets)
@@ -0,0 +1,87 @@
+import argparse
+import asyncio
+import tempfile
+import time
+from async_chat_client import AsyncChatClient
+from bench_load import free_port, start_server, stop_server
+from impairment_proxy import ImpairmentProxy, build_profile, profiles
+
+# how fast one process can push messages through AsyncChatClient: one sender pipelines MSG with await send()
+# and a few receivers in the same event loop read the room with messages()
+# send() is only held back by the servers acks, when the receivers fall more than max_outbound_queue messages
+# behind the server drops their oldest ones, the gaps are counted and anything out of order is a failure
+# usage: python bench_async_client.py --messages 5000 --receivers 4 [--impair lossy]
+
+async def receive_all(client, room, count, done, gaps):
+    last = -1
+    async for message in client.messages(room):
+        index = int(message.text[1:])
+        if index <= last:
+            raise AssertionError(f"m{index} came after m{last}")
+        gaps.append(index - last - 1)
+        last = index
+        if last == count - 1:
+            done.append(time.perf_counter())
+            return
+
+async def run(config, port):
+    clients = []
+    for i in range(config.receivers + 1):
+        client = await AsyncChatClient("127.0.0.1", port, config.batch_delay_ms / 1000).connect()
+        await client.login(f"bot{i}")
+        await client.join("bench")
+        await client.drain()
+        clients.append(client)
+    sender, receivers = clients[0], clients[1:]
+    done = []
+    gaps = []
+    readers = [asyncio.create_task(receive_all(client, "bench", config.messages, done, gaps)) for client in receivers]
+
+    start = time.perf_counter()
+    for i in range(config.messages):
+        await sender.say("bench", f"m{i}")
+    sent = time.perf_counter()
+    await sender.drain()
+    acked = time.perf_counter()
+    await asyncio.wait_for(asyncio.gather(*readers), config.timeout)
+
+    print(f"{config.messages} messages to {config.receivers} receivers" + (f" through {config.impair}" if config.impair else ""))
+    print(f"send returned for all: {sent - start:.2f}s ({config.messages / (sent - start):.0f} msg/s)")
+    print(f"all acked:             {acked - start:.2f}s ({config.messages / (acked - start):.0f} msg/s)")
+    print(f"all delivered:         {max(done) - start:.2f}s ({config.messages * config.receivers / (max(done) - start):.0f} deliveries/s)")
+    print(f"dropped by the server for falling behind: {sum(gaps)} of {config.messages * config.receivers}")
+    print(f"sender retransmissions {sender.stream.retransmissions}, receiver retransmissions "
+          f"{sum(client.stream.retransmissions for client in receivers)}")
+    for client in clients:
+        await client.close(timeout=1.0)
+
+def main():
+    parser = argparse.ArgumentParser(description="AsyncChatClient throughput")
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--receivers", type=int, default=4)
+    parser.add_argument("--engine", choices=["threaded", "asyncio"], default="asyncio")
+    parser.add_argument("--batch-delay-ms", type=float, default=0)
+    parser.add_argument("--impair", choices=sorted(profiles), default=None)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    config = parser.parse_args()
+
+    server_config = {"port": free_port(), "engine": config.engine, "batch_delay_ms": config.batch_delay_ms,
+                     "server_args": ["--idle-timeout", "0"]}
+    proxy = None
+    with tempfile.NamedTemporaryFile("w", prefix="bench_async_", suffix=".log") as log_file:
+        server = start_server(server_config, log_file)
+        try:
+            port = server_config["port"]
+            if config.impair:
+                proxy = ImpairmentProxy(("127.0.0.1", 0), ("127.0.0.1", port), build_profile(config.impair),
+                                        config.seed).start()
+                port = proxy.listen_addr[1]
+            asyncio.run(run(config, port))
+        finally:
+            if proxy is not None:
+                proxy.stop()
+            stop_server(server)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import sys
+import time
+import zlib
+from chat_compression import PayloadCompressor, DICTIONARIES, DICTIONARY_CORPORA, WBITS, MEM_LEVEL, read_corpus
+from chat_protocol import HEADER_SIZE
+
+# bytes on the wire against cpu per message for the payload compression, offline on chat1_heldout.txt, traffic
+# that chat1 was not trained on: room messages both ways, server notices and commands, and history replay
+# chunks made of its room messages, each with the chat1 dictionary at a few thresholds and with plain deflate
+# (no dictionary) for comparison
+# the held out text is from the same rooms and people as the corpus, like a dictionary trained on the traffic
+# of the server it runs on, strangers in other rooms save less
+# wire bytes are the header plus the payload, with --ip the 28 bytes of udp and ipv4 headers are counted too
+# usage: python bench_compression.py [--ip] [messages]
+HELD_OUT = "chat1_heldout.txt"
+
+# room messages as the server sends them and as a client sends them with MSG
+def is_chat(line):
+    return line.startswith("MSG ") or line.startswith("[") and not line.startswith("[Server]")
+# history replies are room messages joined with newlines up to about one datagram, one chunk per starting line
+def history_chunks(lines, size=4096):
+    chunks = []
+    for start in range(len(lines)):
+        chunk = []
+        total = 0
+        while total < size - 200:
+            line = lines[(start + len(chunk)) % len(lines)]
+            chunk.append(line)
+            total += len(line) + 1
+        chunks.append("\n".join(chunk))
+    return chunks
+# the payloads repeated up to count so the timings are over enough calls
+def repeat(payloads, count):
+    return [payloads[i % len(payloads)].encode() for i in range(max(count, len(payloads)))]
+
+# plain deflate with no preset dictionary, to see how much of the saving the dictionary is
+class NoDictionary(PayloadCompressor):
+    def __init__(self, threshold):
+        self.name = "none"
+        self.threshold = threshold
+        self.compress_template = zlib.compressobj(6, zlib.DEFLATED, WBITS, MEM_LEVEL)
+        self.decompress_template = zlib.decompressobj(WBITS)
+
+def measure(compressor, payloads, overhead):
+    plain = sum(len(payload) + overhead for payload in payloads)
+    start = time.perf_counter()
+    encoded = [compressor.compress(payload) for payload in payloads]
+    compress_time = time.perf_counter() - start
+    wire = sum((len(data) if data is not None else len(payload)) + overhead
+               for payload, data in zip(payloads, encoded))
+    squeezed = [data for data in encoded if data is not None]
+    start = time.perf_counter()
+    for data in squeezed:
+        compressor.decompress(data)
+    decompress_time = time.perf_counter() - start
+    return (plain, wire, len(squeezed), compress_time / len(payloads) * 1e6,
+            decompress_time / len(squeezed) * 1e6 if squeezed else 0.0)
+
+def main():
+    args = sys.argv[1:]
+    overhead = HEADER_SIZE + (28 if "--ip" in args else 0)
+    args = [arg for arg in args if arg != "--ip"]
+    count = int(args[0]) if args else 20000
+    held_out = read_corpus(HELD_OUT)
+    chat = [line for line in held_out if is_chat(line)]
+    mixes = {
+        "chat": repeat(chat, count),
+        "notices": repeat([line for line in held_out if not is_chat(line)], count),
+        "history": repeat(history_chunks([line for line in chat if line.startswith("[")]), count // 100),
+    }
+    setups = [(f"chat1 >= {threshold}", PayloadCompressor("chat1", threshold)) for threshold in (0, 24, 48, 96)]
+    setups.append(("no dictionary >= 24", NoDictionary(24)))
+    print(f"wire bytes include {overhead} bytes of headers per packet, chat1 dictionary is {len(DICTIONARIES['chat1'])}"
+          f" bytes trained on {DICTIONARY_CORPORA['chat1']}, measured on {HELD_OUT} ({len(held_out)} lines)")
+    for mix, payloads in mixes.items():
+        average = sum(map(len, payloads)) / len(payloads)
+        print(f"\n{mix}: {len(set(payloads))} distinct payloads, {average:.0f} bytes on average")
+        print(f"{'setup':>20} {'wire bytes':>11} {'saved':>6} {'compressed':>10} {'us/compress':>11} {'us/inflate':>10}")
+        for label, compressor in setups:
+            plain, wire, squeezed, compress_us, decompress_us = measure(compressor, payloads, overhead)
+            print(f"{label:>20} {wire:>11} {1 - wire / plain:>6.1%} {squeezed / len(payloads):>10.0%} "
+                  f"{compress_us:>11.2f} {decompress_us:>10.2f}")
+
+if __name__ == "__main__":
+    main()
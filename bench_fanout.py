@@ -0,0 +1,69 @@
+import gc
+import time
+import chat_serverr_done as server
+
+# cost of one MSG broadcast for rooms of 10 to 10,000 members
+# per-recipient = send_to_client for every member (encode + full packet build each time)
+# encode-once = broadcast_message (one encode, header patched per recipient, no sends under the lock)
+rounds = 5
+
+# stands in for the udp socket so only the server side cost is measured
+class NullSocket:
+    def __init__(self):
+        self.packets = 0
+        self.bytes_sent = 0
+
+    def sendto(self, data, addr):
+        self.packets += 1
+        self.bytes_sent += len(data)
+
+def setup_room(members):
+    server.client_sessions.clear()
+    server.chat_rooms.clear()
+    server.room_members.clear()
+    room = set()
+    for i in range(members):
+        client_addr = ("10.0.%d.%d" % (i // 250, i % 250), 40000 + i)
+        server.initialize_client(client_addr)
+        room.add(client_addr)
+    server.chat_rooms["room"] = room
+    server.update_room_index("room")
+    return tuple(room)
+
+# empties the send windows between rounds so every broadcast goes straight out
+def reset_windows(members):
+    for client_addr in members:
+        send_window = server.client_sessions[client_addr].send_window
+        for seq_num, _ in send_window.release_below(send_window.next_seq):
+            server.retransmit_timers.cancel((client_addr, seq_num))
+
+def per_recipient(members, message):
+    for client_addr in members:
+        server.send_to_client(client_addr, message)
+
+def encode_once(members, message):
+    server.broadcast_message("room", message)
+
+def time_broadcast(func, members, message):
+    total = 0.0
+    for _ in range(rounds):
+        reset_windows(members)
+        # a full collection walks every session, start each round from a clean slate so it lands on neither side
+        gc.collect()
+        start = time.perf_counter()
+        func(members, message)
+        total += time.perf_counter() - start
+    return total / rounds
+
+def main():
+    server.server_socket = NullSocket()
+    message = "[room] someone: " + "hello everyone, " * 4
+    print(f"{'members':>8} {'per-recipient ms':>17} {'encode-once ms':>15} {'us/recipient':>13} {'speedup':>8}")
+    for members in (10, 100, 1000, 10000):
+        room = setup_room(members)
+        old = time_broadcast(per_recipient, room, message)
+        new = time_broadcast(encode_once, room, message)
+        print(f"{members:>8} {old * 1000:>17.2f} {new * 1000:>15.2f} {new / members * 1e6:>13.2f} {old / new:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
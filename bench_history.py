@@ -0,0 +1,74 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+from room_history import RoomHistory
+
+# cost of keeping room history in the mapped log: append time per message, how long replaying the newest
+# messages takes, the python memory per stored message next to a deque of strings holding the same, and what
+# the retention sweep the server runs every minute costs over many small rooms
+# usage: python bench_history.py [messages]
+replays = 200
+sweep_rooms = 1000
+
+def message(i):
+    return f"[room] user{i % 50}: message number {i} with a bit of text after it"
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    directory = tempfile.mkdtemp(prefix="chat_history_")
+    try:
+        history = RoomHistory(directory, max_bytes=64 << 20)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        for i in range(count):
+            history.append("room", message(i))
+        append_us = (time.perf_counter() - start) / count * 1e6
+        log_bytes = tracemalloc.get_traced_memory()[0] - before
+
+        before = tracemalloc.get_traced_memory()[0]
+        in_memory = deque((message(i) for i in range(count)), maxlen=count)
+        deque_bytes = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        del in_memory
+
+        print(f"{count} messages, {history.logs['room'].bytes_on_disk() >> 20} MB of segments")
+        print(f"append: {append_us:.2f} us/message")
+        for limit in (20, 500):
+            start = time.perf_counter()
+            for _ in range(replays):
+                history.replay("room", limit)
+            print(f"replay newest {limit}: {(time.perf_counter() - start) / replays * 1e6:.0f} us")
+        print(f"python memory: log {log_bytes / count:.1f} bytes/message, deque of str {deque_bytes / count:.1f} bytes/message")
+        history.close()
+        sweep(os.path.join(directory, "sweep"))
+    finally:
+        shutil.rmtree(directory)
+
+# the sweep with every room open and nothing expired, after a restart when it has to open every room,
+# and when every room has expired and is removed
+def sweep(directory):
+    history = RoomHistory(directory, segment_bytes=64 << 10, max_open=sweep_rooms)
+    now = time.time()
+    for room in range(sweep_rooms):
+        for i in range(20):
+            history.append(f"room{room}", message(i), now)
+    start = time.perf_counter()
+    history.expire(now)
+    print(f"sweep {sweep_rooms} open rooms, nothing expired: {(time.perf_counter() - start) * 1000:.1f} ms")
+    history.close()
+    history = RoomHistory(directory, segment_bytes=64 << 10, max_open=sweep_rooms)
+    start = time.perf_counter()
+    history.expire(now)
+    print(f"sweep {sweep_rooms} rooms after a restart: {(time.perf_counter() - start) * 1000:.1f} ms")
+    start = time.perf_counter()
+    removed = history.expire(now + history.max_age + 1)
+    print(f"sweep removing {removed} expired rooms: {(time.perf_counter() - start) * 1000:.1f} ms")
+    history.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from chat_clientt_done import ChatClient
+from chat_metrics import LatencyHistogram
+from impairment_proxy import ImpairmentProxy, build_profile, profiles
+
+# headless load generator: starts the server on loopback and drives simulated clients through it
+# every client is a ChatClient (same sequencing, acks, retransmits) running as threads inside a few
+# worker processes, clients are spread over the rooms and send MSG at a fixed rate with a WHO now and then
+# reports goodput, p50/p95/p99 end to end latency, retransmissions and server cpu per message as json
+# usage: python bench_load.py --clients 50 --rooms 10 --messages 200 --output results.json
+server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat_serverr_done.py")
+# marker put in front of every timed message, the receiver reads the send time back out of it
+time_marker = "t="
+
+# a client that times the messages it gets instead of printing them
+class LoadClient(ChatClient):
+    def __init__(self, server_ip, server_port, batch_delay=0):
+        super().__init__(server_ip, server_port, batch_delay)
+        self.latencies = LatencyHistogram()
+        self.delivered = 0
+        self.last_delivery = None
+
+    def deliver_message(self, message):
+        sent = message.partition(": " + time_marker)[2].split(" ", 1)[0]
+        if not sent:
+            return
+        now = time.time()
+        self.latencies.record((now - float(sent)) * 1000)
+        self.delivered += 1
+        self.last_delivery = now
+
+    def start(self):
+        threading.Thread(target=self.receive_ack_loop, daemon=True).start()
+        threading.Thread(target=self.resend_packets_loop, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        self.timer_wakeup.set()
+
+def wait_drained(clients, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if all(client.drained() for client in clients):
+            return True
+        time.sleep(0.01)
+    return False
+# one clients scripted workload, paced at config["rate"] messages a second
+def run_workload(client, room, config):
+    interval = 1.0 / config["rate"] if config["rate"] > 0 else 0
+    padding = "x" * config["message_size"]
+    next_send = time.time()
+    for i in range(config["messages"]):
+        client.send_message(f"MSG {room} {time_marker}{time.time():.6f} {padding}")
+        if config["who_every"] and (i + 1) % config["who_every"] == 0:
+            client.send_message(f"WHO {room}")
+        next_send += interval
+        delay = next_send - time.time()
+        if delay > 0:
+            time.sleep(delay)
+    wait_drained([client], config["drain_timeout"])
+# one worker process, its clients join first, then everyone waits on the barrier so rooms are full before the first MSG
+def run_worker(indexes, config, barrier, results):
+    sys.stdout = open(os.devnull, "w")
+    clients = []
+    for index in indexes:
+        client = LoadClient("127.0.0.1", config["client_port"], config["batch_delay_ms"] / 1000)
+        client.start()
+        client.send_message(f"USERNAME load{index}")
+        client.send_message(f"JOIN room{index % config['rooms']}")
+        clients.append((index, client))
+    wait_drained([client for _, client in clients], config["drain_timeout"])
+
+    barrier.wait()
+    threads = [threading.Thread(target=run_workload, args=(client, f"room{index % config['rooms']}", config))
+               for index, client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    barrier.wait()
+    # the last broadcasts may still be on their way to us
+    time.sleep(config["linger"])
+    barrier.wait()
+
+    latencies = LatencyHistogram()
+    delivered = 0
+    retransmissions = 0
+    last_delivery = None
+    for _, client in clients:
+        # counted before QUIT, the server drops our state on QUIT so it is never acked
+        client.stop()
+        client.send_message("QUIT")
+        latencies.merge(client.latencies)
+        delivered += client.delivered
+        retransmissions += client.stream.retransmissions
+        if client.last_delivery is not None:
+            last_delivery = max(last_delivery or 0, client.last_delivery)
+    results.put({"latencies": latencies, "delivered": delivered, "retransmissions": retransmissions,
+                 "last_delivery": last_delivery})
+# utime + stime of a process and everything it started (the --workers processes) in seconds,
+# None where /proc is not there
+def process_cpu_seconds(pid):
+    total = 0
+    pids = [pid]
+    for current in pids:
+        try:
+            with open(f"/proc/{current}/stat") as stat_file:
+                fields = stat_file.read().rsplit(")", 1)[1].split()
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as children:
+                    pids.extend(int(child) for child in children.read().split())
+        except OSError:
+            if current == pid:
+                return None
+            continue
+        total += int(fields[11]) + int(fields[12])
+    return total / os.sysconf("SC_CLK_TCK")
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(server_script), text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def start_server(config, log_file):
+    command = [sys.executable, "-u", server_script, "--host", "127.0.0.1", "--port", str(config["port"]),
+               "--engine", config["engine"], "--batch-delay-ms", str(config["batch_delay_ms"])]
+    command += config["server_args"]
+    server = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT)
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        log_file.flush()
+        with open(log_file.name) as log:
+            if "Listening" in log.read():
+                return server
+        if server.poll() is not None:
+            break
+        time.sleep(0.05)
+    server.kill()
+    raise RuntimeError("server did not start, see " + log_file.name)
+
+def stop_server(server):
+    server.send_signal(signal.SIGINT)
+    try:
+        server.wait(5)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+def percentiles(histogram):
+    return {f"p{p}": round(histogram.percentile(p), 3) for p in (50, 95, 99)}
+
+def run_benchmark(config):
+    config = dict(config)
+    if not config["port"]:
+        config["port"] = free_port()
+    processes = max(1, min(config["processes"], config["clients"]))
+    log_path = config["server_log"]
+    proxy = None
+    config["client_port"] = config["port"]
+    with open(log_path, "w") as log_file:
+        server = start_server(config, log_file)
+        try:
+            if config["impair"]:
+                # clients talk to the proxy, the proxy talks to the server
+                proxy = ImpairmentProxy(("127.0.0.1", 0), ("127.0.0.1", config["port"]),
+                                        build_profile(config["impair"]), config["seed"]).start()
+                config["client_port"] = proxy.listen_addr[1]
+            barrier = multiprocessing.Barrier(processes + 1)
+            results = multiprocessing.Queue()
+            workers = []
+            for worker in range(processes):
+                indexes = list(range(worker, config["clients"], processes))
+                workers.append(multiprocessing.Process(target=run_worker, args=(indexes, config, barrier, results)))
+            for worker in workers:
+                worker.start()
+
+            barrier.wait()
+            start = time.time()
+            cpu_start = process_cpu_seconds(server.pid)
+            barrier.wait()
+            send_done = time.time()
+            time.sleep(config["linger"])
+            cpu_end = process_cpu_seconds(server.pid)
+            barrier.wait()
+
+            worker_results = [results.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+        finally:
+            stop_server(server)
+            if proxy is not None:
+                proxy.stop()
+    with open(log_path) as log:
+        server_retransmissions = log.read().count("[Server] Retransmitted packet")
+
+    latencies = LatencyHistogram()
+    for result in worker_results:
+        latencies.merge(result["latencies"])
+    delivered = sum(result["delivered"] for result in worker_results)
+    last_delivery = max([result["last_delivery"] for result in worker_results if result["last_delivery"]],
+                        default=send_done)
+    elapsed = max(last_delivery, send_done) - start
+
+    sent = config["clients"] * config["messages"]
+    members = [len(range(room, config["clients"], config["rooms"])) for room in range(config["rooms"])]
+    # every MSG goes to everyone else in the room
+    expected = sum(count * config["messages"] * (count - 1) for count in members)
+    server_cpu = cpu_end - cpu_start if cpu_start is not None and cpu_end is not None else None
+    return {
+        "messages_sent": sent,
+        "deliveries": delivered,
+        "deliveries_expected": expected,
+        "delivery_ratio": round(delivered / expected, 4) if expected else None,
+        "elapsed_s": round(elapsed, 3),
+        "goodput_msgs_per_s": round(sent / elapsed, 1),
+        "goodput_deliveries_per_s": round(delivered / elapsed, 1),
+        "latency_ms": dict(percentiles(latencies), mean=round(latencies.mean(), 3), max=round(latencies.max or 0, 3)),
+        "client_retransmissions": sum(result["retransmissions"] for result in worker_results),
+        "server_retransmissions": server_retransmissions,
+        "server_cpu_s": round(server_cpu, 3) if server_cpu is not None else None,
+        "server_cpu_us_per_msg": round(server_cpu / sent * 1e6, 2) if server_cpu is not None and sent else None,
+        "impairment": proxy.stats() if proxy is not None else None,
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="load generator for the udp chat server")
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--rooms", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=100, help="MSG commands per client")
+    parser.add_argument("--rate", type=float, default=50, help="messages per second per client, 0 = as fast as possible")
+    parser.add_argument("--message-size", type=int, default=32, help="padding bytes added to every message")
+    parser.add_argument("--who-every", type=int, default=25, help="send WHO after this many messages, 0 = never")
+    parser.add_argument("--processes", type=int, default=min(4, os.cpu_count() or 1),
+                        help="worker processes the clients are spread over")
+    parser.add_argument("--engine", choices=["threaded", "asyncio"], default="threaded")
+    parser.add_argument("--batch-delay-ms", type=float, default=0, help="batching delay for server and clients")
+    parser.add_argument("--server-arg", dest="server_args", action="append", default=[],
+                        help="extra argument passed through to the server, can be repeated")
+    parser.add_argument("--impair", choices=sorted(profiles), help="run the clients through impairment_proxy with this profile")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the impairment proxy")
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port")
+    parser.add_argument("--linger", type=float, default=1.0, help="seconds to wait for the last deliveries")
+    parser.add_argument("--drain-timeout", type=float, default=30.0, help="longest to wait for a client's acks")
+    parser.add_argument("--server-log", default=os.path.join(tempfile.gettempdir(), "bench_load_server.log"))
+    parser.add_argument("--output", help="write the json result here, stdout if not set")
+    parser.add_argument("--compare", help="earlier json result to compare against")
+    parser.add_argument("--max-regression", type=float, default=10.0,
+                        help="with --compare, exit with 1 if goodput drops or p99 grows by more than this percent")
+    return parser.parse_args(argv)
+# prints how this run moved against an earlier one, returns False if goodput or p99 got worse than allowed
+def compare_results(baseline, results, max_regression):
+    ok = True
+    for name, higher_is_better in (("goodput_msgs_per_s", True), ("goodput_deliveries_per_s", True),
+                                   ("p99", False), ("p50", False), ("server_cpu_us_per_msg", False)):
+        old = baseline.get(name, baseline["latency_ms"].get(name))
+        new = results.get(name, results["latency_ms"].get(name))
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        worse = -change if higher_is_better else change
+        flag = ""
+        if name in ("goodput_msgs_per_s", "p99") and worse > max_regression:
+            flag = "  REGRESSION"
+            ok = False
+        print(f"{name:>26} {old:>10} -> {new:<10} {change:+.1f}%{flag}")
+    return ok
+
+def main():
+    args = parse_args()
+    config = dict(vars(args))
+    output = config.pop("output")
+    for name in ("compare", "max_regression"):
+        config.pop(name)
+    report = {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "config": config, "results": run_benchmark(config)}
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as out_file:
+            out_file.write(text + "\n")
+        results = report["results"]
+        print(f"goodput {results['goodput_msgs_per_s']} msg/s, latency p50/p95/p99 "
+              f"{results['latency_ms']['p50']}/{results['latency_ms']['p95']}/{results['latency_ms']['p99']} ms, "
+              f"server cpu {results['server_cpu_us_per_msg']} us/msg -> {output}")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if not compare_results(baseline["results"], report["results"], args.max_regression):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
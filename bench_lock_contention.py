@@ -0,0 +1,121 @@
+import os
+import socket
+import sys
+import threading
+import time
+import chat_serverr_done as server
+from chat_protocol import create_packet, create_ack_packet
+from chat_metrics import LatencyHistogram
+from retransmit_scheduler import RetransmitScheduler
+
+# many rooms busy at once: every thread owns its own rooms and pushes MSG packets through handle_datagram
+# while the timer loop runs next to them, the same work is run with one shared mutex around every call
+# (what the old global thread_lock did) and with the per-client/per-room locks the server uses now
+# packets really go out over loopback to a socket nobody reads, so the sendto syscalls are part of what the old lock covered
+# usage: python bench_lock_contention.py [messages per thread]
+members_per_room = 10
+rooms_per_thread = 4
+
+def setup(threads):
+    server.client_sessions.clear()
+    server.chat_rooms.clear()
+    server.room_members.clear()
+    server.client_usernames.clear()
+    server.retransmit_timers = RetransmitScheduler()
+    server.ack_timers = RetransmitScheduler()
+    server.idle_timers = RetransmitScheduler()
+    workloads = []
+    for thread in range(threads):
+        rooms = []
+        for room in range(rooms_per_thread):
+            room_name = f"room{thread}-{room}"
+            members = []
+            for member in range(members_per_room):
+                client_addr = (f"10.{thread}.{room}.{member}", 40000)
+                server.initialize_client(client_addr)
+                server.client_usernames[client_addr] = f"user{thread}-{room}-{member}"
+                members.append(client_addr)
+            server.chat_rooms[room_name] = set(members)
+            server.update_room_index(room_name)
+            rooms.append((room_name, members, [0] * members_per_room))
+        workloads.append(rooms)
+    return workloads
+# one thread's rooms, every member takes turns sending and everyone acks what they got so windows stay open
+def drive(rooms, messages, guard, latencies):
+    for i in range(messages):
+        room_name, members, next_seq = rooms[i % len(rooms)]
+        sender = i // len(rooms) % len(members)
+        packet = create_packet(next_seq[sender], 0, f"MSG {room_name} hello {i}".encode())
+        next_seq[sender] += 1
+        start = time.perf_counter()
+        with guard:
+            server.handle_datagram(packet, members[sender])
+        latencies.record((time.perf_counter() - start) * 1e6)
+        if i % len(rooms) == len(rooms) - 1:
+            for client_addr in members:
+                ack = create_ack_packet(server.client_sessions[client_addr].send_window.next_seq, 0)
+                with guard:
+                    server.handle_datagram(ack, client_addr)
+
+def timer_loop(guard, stop):
+    while not stop.is_set():
+        with guard:
+            server.service_timers(server.server_socket)
+        time.sleep(0.001)
+
+def run(threads, messages, guard):
+    workloads = setup(threads)
+    latencies = [LatencyHistogram() for _ in range(threads)]
+    stop = threading.Event()
+    timer = threading.Thread(target=timer_loop, args=(guard, stop))
+    workers = [threading.Thread(target=drive, args=(workloads[i], messages, guard, latencies[i])) for i in range(threads)]
+    timer.start()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    timer.join()
+    merged = LatencyHistogram()
+    for histogram in latencies:
+        merged.merge(histogram)
+    return threads * messages / elapsed, merged
+
+# a real udp socket that sends everything to one address whatever the client address is
+class RedirectSocket:
+    def __init__(self, sock, target):
+        self.sock = sock
+        self.target = target
+
+    def sendto(self, data, addr):
+        return self.sock.sendto(data, self.target)
+
+# stands in for a lock when there is nothing to guard
+class NoLock:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(("127.0.0.1", 0))
+    # every client sends to the sink, the address the server thinks it has is only used as a key
+    server.server_socket = RedirectSocket(socket.socket(socket.AF_INET, socket.SOCK_DGRAM), sink.getsockname())
+    server.print = lambda *args, **kwargs: None
+    # threads only run python in parallel on a free threaded build with more than one cpu
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(f"cpus {os.cpu_count()}, gil {'on' if gil else 'off'}, {rooms_per_thread} rooms of {members_per_room} per thread")
+    print(f"{'threads':>7} {'lock':>12} {'msgs/s':>10} {'p50 us':>8} {'p99 us':>8} {'p999 us':>8}")
+    for threads in (1, 2, 4, 8, 16):
+        for name, guard in (("global", threading.Lock()), ("fine-grained", NoLock())):
+            rate, latencies = run(threads, messages, guard)
+            print(f"{threads:>7} {name:>12} {rate:>10.0f} {latencies.percentile(50):>8.1f}"
+                  f" {latencies.percentile(99):>8.1f} {latencies.percentile(99.9):>8.1f}")
+
+if __name__ == "__main__":
+    main()
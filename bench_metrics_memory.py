@@ -0,0 +1,41 @@
+import sys
+import tracemalloc
+import chat_serverr_done as server
+
+# records millions of latencies for one client through the servers metric code and
+# checks that memory stays flat, exits with 1 if it grew by more than max_growth bytes
+# usage: python bench_metrics_memory.py [messages]
+checkpoints = 10
+max_growth = 64 * 1024
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    client_addr = ("127.0.0.1", 40000)
+    session = server.initialize_client(client_addr)
+    metrics = session.metrics
+
+    tracemalloc.start()
+    step = messages // checkpoints
+    baseline = None
+    print(f"{'messages':>10} {'traced bytes':>13} {'p50':>7} {'p99':>7} {'p999':>7}")
+    for checkpoint in range(1, checkpoints + 1):
+        for i in range((checkpoint - 1) * step, checkpoint * step):
+            if i % 1000 == 0:
+                now = server.current_time_millis()
+            # pretend the packet arrived 0-249 ms ago
+            server.latency_metrics(session, now - i % 250)
+        current, peak = tracemalloc.get_traced_memory()
+        if baseline is None:
+            baseline = current
+        latencies = metrics.latency_histogram
+        print(f"{checkpoint * step:>10} {current:>13} {latencies.percentile(50):>7.1f}"
+              f" {latencies.percentile(99):>7.1f} {latencies.percentile(99.9):>7.1f}")
+
+    growth = current - baseline
+    print(f"growth after first checkpoint: {growth} bytes")
+    if growth > max_growth:
+        print("memory is not flat")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
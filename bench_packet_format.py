@@ -0,0 +1,65 @@
+import time
+from chat_protocol import create_packet, create_text_packet, iter_packets, create_batch_packet
+
+# serialize/parse cost of the old text framing vs the binary header, per packet the way each server does it
+# build: the old server formatted and encoded the message for every recipient, the binary one encodes a
+# broadcast once and only puts a header in front of the bytes for each recipient
+# parse: the old decode_packet decoded and split every datagram, iter_packets only reads the header and slices
+# the payload out, "+str" adds decoding a plain chat message to text, which the server does once it knows the
+# packet is not a duplicate and acks, fragments and compressed payloads never need, batch is one datagram of
+# eight packets of that size divided by eight
+# message sizes cover acks, short chat lines (32-128 bytes is typical) and long pastes
+# every column is timed in turn within each run and the best run is kept, so load on the machine hits all alike
+sizes = (0, 32, 64, 128, 512, 2048)
+rounds = 50000
+runs = 7
+
+# the old decode_packet, full decode and split on every datagram
+def text_decode(packet_bytes):
+    try:
+        parts = packet_bytes.decode().split("|", 2)
+        return int(parts[0]), int(parts[1]), parts[2]
+    except Exception:
+        return None, None, None
+
+# what a receiver does with a binary datagram before it can run its messages
+def binary_decode(packet):
+    messages = []
+    for seq_num, ack_num, flags, payload in iter_packets(packet):
+        messages.append((seq_num, ack_num, payload.decode("utf-8", "replace")))
+    return messages
+# ns per call of each (func, args, calls per packet)
+def time_per_packet(cases):
+    best = [None] * len(cases)
+    for _ in range(runs):
+        for index, (func, args, per_call) in enumerate(cases):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                func(*args)
+            elapsed = (time.perf_counter() - start) / rounds / per_call * 1e9
+            best[index] = elapsed if best[index] is None else min(best[index], elapsed)
+    return best
+
+def main():
+    print(f"{'bytes':>6} {'text build':>11} {'bin build':>10} {'text parse':>11} {'bin parse':>10} {'bin +str':>9}"
+          f" {'batch +str':>11} {'text len':>9} {'bin len':>8}  (ns per packet)")
+    for size in sizes:
+        message = "MSG room " + "x" * max(0, size - 9) if size else ""
+        payload = message.encode()
+        text_packet = create_text_packet(123456, 654321, message)
+        binary_packet = create_packet(123456, 654321, payload)
+        batch_packet = create_batch_packet([binary_packet] * 8)
+
+        timings = time_per_packet([
+            (create_text_packet, (123456, 654321, message), 1),
+            (create_packet, (123456, 654321, payload), 1),
+            (text_decode, (text_packet,), 1),
+            (iter_packets, (binary_packet,), 1),
+            (binary_decode, (binary_packet,), 1),
+            (binary_decode, (batch_packet,), 8),
+        ])
+        print(f"{size:>6} " + " ".join(f"{value:>{width}.0f}" for value, width in zip(timings, (11, 10, 11, 10, 9, 11)))
+              + f" {len(text_packet):>9} {len(binary_packet):>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import time
+import sys
+from retransmit_scheduler import RetransmitScheduler
+
+# compares the old 100ms full scan of every send window with the deadline heap
+# usage: python bench_retransmit.py [clients]
+ack_timeout = 1.0
+rounds = 20
+
+# the way retransmit_unacked_packets used to find timed out packets
+def full_scan(client_states, now):
+    expired = []
+    for client_addr, state in client_states.items():
+        send_window = state["send_window"]
+        for seq_num in list(send_window.keys()):
+            message, last_sent_time, retrans_count = send_window[seq_num]
+            if now - last_sent_time > ack_timeout:
+                expired.append((client_addr, seq_num))
+    return expired
+
+def build(in_flight, clients, now):
+    client_states = {}
+    timers = RetransmitScheduler()
+    for i in range(in_flight):
+        client_addr = ("127.0.0.1", 10000 + i % clients)
+        seq_num = i // clients
+        # everything was sent just now so nothing is due yet
+        state = client_states.setdefault(client_addr, {"send_window": {}})
+        state["send_window"][seq_num] = ("MSG room hello", now, 0)
+        timers.schedule((client_addr, seq_num), now + ack_timeout)
+    return client_states, timers
+
+def time_per_call(func, *args):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(*args)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    print(f"{'in flight':>10} {'full scan us':>14} {'heap tick us':>14} {'ack cancel us':>14}")
+    for in_flight in (100, 1000, 10000, 100000):
+        now = time.time()
+        client_states, timers = build(in_flight, clients, now)
+        scan_us = time_per_call(full_scan, client_states, now)
+        heap_us = time_per_call(timers.pop_expired, now)
+
+        keys = list(timers.entries.keys())
+        start = time.perf_counter()
+        for key in keys:
+            timers.cancel(key)
+        cancel_us = (time.perf_counter() - start) / len(keys) * 1e6
+
+        print(f"{in_flight:>10} {scan_us:>14.1f} {heap_us:>14.2f} {cancel_us:>14.3f}")
+
+if __name__ == "__main__":
+    main()
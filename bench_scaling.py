@@ -0,0 +1,51 @@
+import argparse
+import json
+import os
+import time
+import bench_load
+
+# aggregate goodput of the server with --workers 1, 2, 4 ... up to --max-workers, one bench_load run each
+# clients send as fast as their windows allow unless --rate is given, any other bench_load option is passed through
+# usage: python bench_scaling.py --max-workers 4 --output scaling.json -- --clients 64 --rooms 16 --messages 200
+def worker_counts(max_workers):
+    counts = []
+    workers = 1
+    while workers < max_workers:
+        counts.append(workers)
+        workers *= 2
+    counts.append(max_workers)
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="goodput scaling of the --workers server mode")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", help="write the json results here")
+    args, rest = parser.parse_known_args()
+    if rest and rest[0] == "--":
+        rest = rest[1:]
+    load_args = bench_load.parse_args(["--rate", "0"] + rest)
+    base = dict(vars(load_args))
+    for name in ("output", "compare", "max_regression"):
+        base.pop(name)
+
+    runs = []
+    print(f"cpus {os.cpu_count()}")
+    print(f"{'workers':>7} {'msgs/s':>9} {'deliveries/s':>13} {'p50 ms':>8} {'p99 ms':>8} {'cpu us/msg':>11} {'scaling':>8}")
+    for workers in worker_counts(args.max_workers):
+        config = dict(base, server_args=base["server_args"] + ["--workers", str(workers)])
+        results = bench_load.run_benchmark(config)
+        runs.append({"workers": workers, "results": results})
+        scaling = results["goodput_deliveries_per_s"] / runs[0]["results"]["goodput_deliveries_per_s"]
+        print(f"{workers:>7} {results['goodput_msgs_per_s']:>9} {results['goodput_deliveries_per_s']:>13}"
+              f" {results['latency_ms']['p50']:>8} {results['latency_ms']['p99']:>8}"
+              f" {results['server_cpu_us_per_msg']!s:>11} {scaling:>7.2f}x")
+
+    if args.output:
+        report = {"commit": bench_load.git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "cpus": os.cpu_count(), "config": base, "runs": runs}
+        with open(args.output, "w") as out_file:
+            json.dump(report, out_file, indent=2)
+            out_file.write("\n")
+
+if __name__ == "__main__":
+    main()
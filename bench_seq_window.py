@@ -0,0 +1,72 @@
+import sys
+import time
+from seq_window import ReceiveWindow, SendWindow
+
+# the old unbounded dict windows against ReceiveWindow and SendWindow, per packet cost of the receive path with some reordering
+# and of acking a full send window one cumulative ack at a time, the way the server sees a steady stream
+# usage: python bench_seq_window.py [packets]
+window_size = 100
+
+# every 10th packet arrives one place late
+def arrival_order(packets):
+    order = list(range(packets))
+    for i in range(0, packets - 1, 10):
+        order[i], order[i + 1] = order[i + 1], order[i]
+    return order
+
+# the old out_of_order_buffer, a dict keyed by seq with no limit on how far ahead it takes packets
+def dict_receive(order):
+    buffer = {}
+    expected = 0
+    for seq_num in order:
+        if seq_num < expected or seq_num in buffer:
+            continue
+        buffer[seq_num] = ("MSG room hello", 0, 0)
+        while expected in buffer:
+            buffer.pop(expected)
+            expected += 1
+    return expected
+
+def window_receive(order):
+    window = ReceiveWindow(window_size)
+    for seq_num in order:
+        if window.offer(seq_num, ("MSG room hello", 0, 0)):
+            while window.pop() is not None:
+                pass
+    return window.expected
+
+# the old release_acked_packets, a list copy of the send window keys for every ack
+def dict_acks(packets):
+    send_window = {}
+    next_seq = 0
+    for ack in range(1, packets + 1):
+        while next_seq < ack + window_size - 1:
+            send_window[next_seq] = (b"hello", 0, 0, 0)
+            next_seq += 1
+        for seq_num in [seq_num for seq_num in send_window if seq_num < ack]:
+            send_window.pop(seq_num)
+    return len(send_window)
+
+def window_acks(packets):
+    send_window = SendWindow(window_size)
+    for ack in range(1, packets + 1):
+        while send_window.room() > 1:
+            send_window.add((b"hello", 0, 0, 0))
+        send_window.release_below(ack)
+    return len(send_window)
+
+def per_packet(func, arg, packets):
+    start = time.perf_counter()
+    func(arg)
+    return (time.perf_counter() - start) / packets * 1e6
+
+def main():
+    packets = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    order = arrival_order(packets)
+    print(f"{packets} packets, window {window_size}")
+    print(f"{'':>10}  {'old us/pkt':>11}  {'now us/pkt':>11}")
+    print(f"{'receive':>10}  {per_packet(dict_receive, order, packets):>11.2f}  {per_packet(window_receive, order, packets):>11.2f}")
+    print(f"{'ack':>10}  {per_packet(dict_acks, packets, packets):>11.2f}  {per_packet(window_acks, packets, packets):>11.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import sys
+import time
+import tracemalloc
+import chat_serverr_done as server
+from bench_fanout import NullSocket
+
+# bytes per idle client session, the servers ClientSession against what the original server kept per client,
+# and what the idle sweep costs when nothing is due and when every session has gone quiet
+# usage: python bench_session_memory.py [sessions]
+
+# the original servers initialize_client as it was: a state dict and a metrics dict per address, no locks,
+# timers, congestion control, reassembly or idle expiry, so it is the floor and not a like for like layout
+class OriginalServer:
+    def __init__(self):
+        self.client_states = {}
+        self.client_metrics = {}
+
+    def initialize_client(self, client_addr):
+        if client_addr not in self.client_states:
+            self.client_states[client_addr] = {
+                "expected_sequence": 0,
+                "out_of_order_buffer": {},
+                "send_window": {},
+            }
+            self.client_metrics[client_addr] = {
+                "retransmissions_count": 0,
+                "out_of_order_count": 0,
+                "latency_list": [],
+                "messages_received": 0,
+                "bytes_received": 0,
+                "start_timestamp": None,
+                "end_timestamp": None,
+                "total_packets_received": 0,
+                "acks_received": set(),
+            }
+
+def measure(make, count):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = [make(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / count, sessions
+
+def client_addr(i):
+    return ("10.%d.%d.%d" % (i >> 16 & 255, i >> 8 & 255, i & 255), 40000)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    server.server_socket = NullSocket()
+    server.print = lambda *args, **kwargs: None
+
+    # both include the entries in the per address tables, the new server also has an idle timer per session
+    original = OriginalServer()
+    old_bytes, _ = measure(lambda i: original.initialize_client(client_addr(i)), count)
+    new_bytes, _ = measure(lambda i: server.initialize_client(client_addr(i)), count)
+    print(f"{count} sessions")
+    print(f"{'original server':>24}: {old_bytes:>8.0f} bytes/session")
+    print(f"{'ClientSession':>24}: {new_bytes:>8.0f} bytes/session ({new_bytes - old_bytes:+.0f}, two locks, the"
+          f" rtt and congestion state and the idle timer)")
+
+    # half the clients keep talking, the other half went away without a QUIT
+    now = time.time()
+    for i in range(count):
+        session = server.client_sessions[client_addr(i)]
+        session.last_seen = now - (0 if i % 2 else server.idle_timeout + 1)
+    start = time.perf_counter()
+    server.expire_idle_clients()
+    nothing_due = time.perf_counter() - start
+
+    server.idle_timers = type(server.idle_timers)()
+    for address, session in server.client_sessions.items():
+        server.idle_timers.schedule(address, session.last_seen + server.idle_timeout)
+    start = time.perf_counter()
+    server.expire_idle_clients()
+    sweep = time.perf_counter() - start
+    print(f"sweep with nothing due: {nothing_due * 1e6:.0f} us")
+    print(f"sweep dropping {count - len(server.client_sessions)} idle sessions: {sweep * 1000:.1f} ms "
+          f"({sweep / max(1, count - len(server.client_sessions)) * 1e6:.1f} us each), {len(server.client_sessions)} left")
+
+if __name__ == "__main__":
+    main()
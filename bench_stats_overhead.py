@@ -0,0 +1,34 @@
+import sys
+import time
+from server_stats import ServerStats
+
+# what the stats hooks add to a server stage: one start/stop pair plus a counter increment,
+# with timing off, sampling 1 in 100 and timing every call, next to the same loop with no hooks
+# usage: python bench_stats_overhead.py [calls]
+
+def bare(stats, calls):
+    for _ in range(calls):
+        pass
+
+def hooked(stats, calls):
+    for _ in range(calls):
+        started = stats.start()
+        stats.packets_received += 1
+        stats.stop("recv", started)
+
+def ns_per_call(func, stats, calls):
+    start = time.perf_counter()
+    func(stats, calls)
+    return (time.perf_counter() - start) / calls * 1e9
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    baseline = ns_per_call(bare, ServerStats(), calls)
+    print(f"{calls} calls, loop alone {baseline:.0f} ns")
+    for sample_every in (0, 100, 1):
+        cost = ns_per_call(hooked, ServerStats(sample_every), calls) - baseline
+        label = "timing off" if sample_every == 0 else f"sampling 1 in {sample_every}"
+        print(f"{label:>18}: {cost:>6.0f} ns per stage")
+
+if __name__ == "__main__":
+    main()
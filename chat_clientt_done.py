@@ -1,124 +1,147 @@
+import asyncio
 import socket
 import threading
 import time
 import sys
+from batching import PacketBatcher
+from chat_compression import DICTIONARIES
+from client_stream import ClientStream, max_packet
+from async_chat_client import AsyncChatClient
 
-max_packet = 4096
-window_size = 100
-ack_timeout = 1.0
+# receive buffer, bigger than anything the server sends so nothing is cut off
+max_datagram = 65535
 
-# decodes the packet
-def decode_packet(packet_bytes):
-    try:
-        parts = packet_bytes.decode().split("|", 2)
-        seq_num = int(parts[0])
-        ack_num = int(parts[1])
-        payload = parts[2]
-        return seq_num, ack_num, payload
-    except Exception:
-        return None, None, None
-
-# connects to the client
+# the threaded client, the command line uses AsyncChatClient and bench_load runs many of these
+# the protocol is ClientStream, this runs it on a blocking socket with a receive thread and a timer thread
+# send_message never blocks, what does not fit in the window waits in the streams queue
 class ChatClient:
-    def __init__(self, server_ip, server_port):
-        self.retransmissions = 0
+    def __init__(self, server_ip, server_port, batch_delay=0, compression=True):
         self.server_address = (server_ip, server_port)
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket.settimeout(0.5)
-
-        self.send_base = 0            
-        self.next_sequence_number = 0 
+        # covers the stream, both threads and send_message use it
         self.thread_lock = threading.Lock()
-        self.send_window = {}         
-        self.acks_received = set()
+        self.stream = ClientStream(list(DICTIONARIES) if compression else [])
+        # set when a timer is armed so the resend loop stops sleeping early
+        self.timer_wakeup = threading.Event()
+        # with a batch delay packets to the server are coalesced into one datagram
+        self.batcher = PacketBatcher(batch_delay, max_packet) if batch_delay > 0 else None
         self.running = True
-# creates the packet
-    def create_packet(self, seq_num, ack_num, message):
-        return f"{seq_num}|{ack_num}|{message}".encode()
+# sends what the stream gave us, through the batcher when batching is on, caller holds thread_lock
+    def transmit(self, packets):
+        for packet in packets:
+            if self.batcher is None:
+                self.socket.sendto(packet, self.server_address)
+            elif self.batcher.send(self.socket, self.server_address, packet):
+                self.timer_wakeup.set()
 #resends packets that have ot been acknowledged 
     def resend_packets_loop(self):
         while self.running:
-            time.sleep(0.1)
-            current_time = time.time()
+            now = time.time()
             with self.thread_lock:
-                for seq_num in list(self.send_window.keys()):
-                    message, last_sent_time, retrans_count = self.send_window[seq_num]
-
-                    if seq_num in self.acks_received:
-                        continue 
-
-                    if current_time - last_sent_time > ack_timeout:
-                        self.socket.sendto(self.create_packet(seq_num, 0, message), self.server_address)
-                        self.send_window[seq_num] = (message, current_time, retrans_count + 1)
-                        self.retransmissions += 1
-                        print(f"[Client] retransmitted seq {seq_num}")
-                        
+                delay = min(0.1, max(0.0, self.stream.next_deadline() - now))
+            if self.batcher is not None:
+                delay = self.batcher.time_until_next(now, delay)
+            self.timer_wakeup.wait(delay)
+            self.timer_wakeup.clear()
+            with self.thread_lock:
+                self.transmit(self.stream.on_timer(time.time()))
+            if self.batcher is not None:
+                self.batcher.flush_expired(self.socket)
 # always running waiting for acks
     def receive_ack_loop(self):
         while self.running:
             try:
-                data, _ = self.socket.recvfrom(max_packet)
-                seq_num, ack_num, payload = decode_packet(data)
-
-                if payload == "" and seq_num == 0:
-                    with self.thread_lock:
-                        if ack_num in self.send_window and ack_num not in self.acks_received:
-                            self.acks_received.add(ack_num)
-                        while self.send_base in self.acks_received:
-                            del self.send_window[self.send_base]
-                            self.send_base += 1
-                else:
-                    print(f"\n{payload}")
-
+                data, _ = self.socket.recvfrom(max_datagram)
+                self.handle_datagram(data)
             except socket.timeout:
                 continue
             except Exception as e:
                 print("[Client] Socket error:", e)
-# user retrsmissions
-    def user_retansmissions(self):
-        print("\n--- Metrics ---")
-        print(f"Retransmissions: {self.retransmissions}")
-        print("---------------------------")
-# text and inputs that popup when you first connect
-    def start_up_messages(self):
-        username = input("Enter username: ").strip()
-        self.send_message(f"USERNAME {username}")
-
-        print("Commands: JOIN <room>, LEAVE <room>, MSG <room> <text>, WHO <room>, ROOMS, QUIT")
-
-        while True:
-            user_input = input("> ").strip()
-            if not user_input:
-                continue
-
-            if user_input.upper() == "QUIT":
-                self.send_message("QUIT")
-                break
-
-            self.send_message(user_input)
-
-        self.running = False
-        self.user_retansmissions()
+# one datagram from the server, the lines in it are shown after the lock is released
+    def handle_datagram(self, data):
+        with self.thread_lock:
+            resets = self.stream.resets
+            ack_was_due = self.stream.ack_deadline is not None
+            packets, lines = self.stream.receive(data, time.time())
+            self.transmit(packets)
+            if not ack_was_due and self.stream.ack_deadline is not None:
+                # a delayed ack was armed, the resend loop may be sleeping past it
+                self.timer_wakeup.set()
+        if self.stream.resets != resets:
+            print("[Client] The server dropped our session, logging in again")
+        for line in lines:
+            self.deliver_message(line)
+# shows a message from the server
+    def deliver_message(self, message):
+        print(f"\n{message}")
 # sends message to the server
+# anything too big for one datagram goes out as fragments that are acked and resent one by one
     def send_message(self, message):
         with self.thread_lock:
-            if self.next_sequence_number < self.send_base + window_size:
-                seq_num = self.next_sequence_number
-                self.send_window[seq_num] = (message, time.time(), 0)
-                self.socket.sendto(self.create_packet(seq_num, 0, message), self.server_address)
-                self.next_sequence_number += 1
+            self.stream.queue(message)
+            self.transmit(self.stream.pump(time.time()))
+
+    def login(self, username):
+        self.send_message(self.stream.login_line(username))
+# true once everything we sent has been acked
+    def drained(self):
+        with self.thread_lock:
+            return self.stream.drained()
+# user retrsmissions
+def user_retansmissions(client):
+    print("\n--- Metrics ---")
+    print(f"Retransmissions: {client.stream.retransmissions}")
+    print(f"Congestion window: {client.stream.cwnd.cwnd:.1f}")
+    print(f"RTO (ms): {client.stream.rtt.rto * 1000:.1f}")
+    print("---------------------------")
+# reads one line without blocking the event loop, None at end of input
+async def read_line(prompt):
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, input, prompt)
+    except EOFError:
+        return None
+# shows everything the server sends while the prompt is up
+async def print_messages(client):
+    async for message in client.messages():
+        print(f"\n{message}")
+# text and inputs that popup when you first connect, the interactive side of AsyncChatClient
+async def start_up_messages(client):
+    username = await read_line("Enter username: ")
+    if username is None:
+        return
+    await client.login(username.strip())
+
+    print("Commands: JOIN <room>, LEAVE <room>, MSG <room> <text>, WHO <room>, HISTORY <room> [n|since], ROOMS, QUIT")
+
+    while True:
+        user_input = await read_line("> ")
+        if user_input is None or user_input.strip().upper() == "QUIT":
+            break
+        user_input = user_input.strip()
+        if user_input:
+            await client.send(user_input)
+
+async def run_cli(server_ip, server_port, batch_delay):
+    client = await AsyncChatClient(server_ip, server_port, batch_delay).connect()
+    printer = asyncio.create_task(print_messages(client))
+    try:
+        await start_up_messages(client)
+    finally:
+        await client.close()
+        printer.cancel()
+    user_retansmissions(client)
 #main
 def main():
-    if len(sys.argv) != 3:
-        print(f"Usage: python {sys.argv[0]} <server_ip> <server_port>")
+    if len(sys.argv) not in (3, 4):
+        print(f"Usage: python {sys.argv[0]} <server_ip> <server_port> [batch_delay_ms]")
         sys.exit(1)
 
-    client = ChatClient(sys.argv[1], int(sys.argv[2]))
-
-    threading.Thread(target=client.receive_ack_loop, daemon=True).start()
-    threading.Thread(target=client.resend_packets_loop, daemon=True).start()
-
-    client.start_up_messages()
+    batch_delay = float(sys.argv[3]) / 1000 if len(sys.argv) == 4 else 0
+    try:
+        asyncio.run(run_cli(sys.argv[1], int(sys.argv[2]), batch_delay))
+    except KeyboardInterrupt:
+        pass
 
 
 if __name__ == "__main__":
@@ -0,0 +1,91 @@
+import os
+import zlib
+from collections import Counter
+
+# optional payload compression, a client offers it with "USERNAME <name> compress=<dictionary>" and the server
+# turns it on for that client when it knows the dictionary, packets that carry a compressed payload have
+# FLAG_COMPRESSED set and anything under the threshold or that does not get smaller goes out as it was
+# every payload is compressed on its own (raw deflate, no stream state between messages) so a lost or resent
+# packet never stalls the others and a broadcast is still compressed once for the whole room, the preset
+# dictionary is what makes 50 byte chat lines shrink at all
+COMPRESSION_THRESHOLD = 24
+# raw deflate with a 2k window and a small hash table, a dictionary never goes past the window and copying
+# the compressor for every payload is what costs, at the zlib defaults the copy alone is over 100us
+WBITS = -11
+MEM_LEVEL = 5
+MAX_DECOMPRESSED = 1 << 20
+
+# compressing and decompressing with one dictionary, the dictionary is loaded into a template once and
+# every payload works on a copy of it, which is much cheaper than priming a new context each time
+class PayloadCompressor:
+    def __init__(self, name, threshold=COMPRESSION_THRESHOLD):
+        self.name = name
+        self.threshold = threshold
+        dictionary = DICTIONARIES[name]
+        self.compress_template = zlib.compressobj(6, zlib.DEFLATED, WBITS, MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, dictionary)
+        self.decompress_template = zlib.decompressobj(WBITS, dictionary)
+# the compressed payload, or None when it is too short to bother or would not get smaller
+    def compress(self, payload):
+        if len(payload) < self.threshold:
+            return None
+        compressor = self.compress_template.copy()
+        data = compressor.compress(payload) + compressor.flush()
+        return data if len(data) < len(payload) else None
+# the original payload, or None when the data is broken or would inflate past max_size
+    def decompress(self, data, max_size=MAX_DECOMPRESSED):
+        decompressor = self.decompress_template.copy()
+        try:
+            payload = decompressor.decompress(data, max_size)
+        except zlib.error:
+            return None
+        if decompressor.unconsumed_tail or not decompressor.eof:
+            return None
+        return payload
+
+# the dictionary names a client offers, in order of preference, and the one a server picks from an offer
+def offer_token(names):
+    return "compress=" + ",".join(names)
+
+def pick_dictionary(tokens):
+    for token in tokens:
+        key, _, value = token.partition("=")
+        if key.lower() != "compress":
+            continue
+        for name in value.split(","):
+            if name in DICTIONARIES:
+                return name
+    return None
+
+# builds a dictionary from sample messages, the substrings that save the most bytes go in, most valuable last
+# since deflate finds matches closer to the end cheaper, the result only depends on the samples
+def train_dictionary(samples, size=2048, lengths=(4, 6, 8, 12, 16, 24)):
+    counts = Counter()
+    for sample in samples:
+        for length in lengths:
+            for start in range(0, max(0, len(sample) - length + 1), 2):
+                counts[sample[start:start + length]] += 1
+    scored = sorted(((count - 1) * len(text), text) for text, count in counts.items() if count > 1)
+    picked = []
+    total = 0
+    for score, text in reversed(scored):
+        if total + len(text) > size:
+            continue
+        if any(text in chosen for chosen in picked):
+            continue
+        picked.append(text)
+        total += len(text)
+    return "".join(reversed(picked)).encode()
+
+# every dictionary is trained from a corpus file next to this module, one payload per line as it goes over the
+# wire in either direction, client and server train the same bytes from the same file when they start (about 50ms)
+# a corpus is never edited once clients use it, a new corpus gets a new dictionary name and the old ones stay
+# chat1_heldout.txt is the same kind of traffic kept out of training, bench_compression.py measures on it
+DICTIONARY_CORPORA = {
+    "chat1": "chat1_corpus.txt",
+}
+
+def read_corpus(filename):
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), filename), encoding="utf-8") as corpus:
+        return [line.rstrip("\n") for line in corpus if line.strip()]
+
+DICTIONARIES = {name: train_dictionary(read_corpus(filename)) for name, filename in DICTIONARY_CORPORA.items()}
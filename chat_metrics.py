@@ -0,0 +1,70 @@
+import math
+
+# log-bucketed latency histogram (hdr style): every power of two is split into SUB_BUCKETS linear buckets
+# so percentiles are within ~1.5% and memory is fixed no matter how many values are recorded
+# only buckets that were hit are stored, latencies bunch up in a few of them so a client costs a few hundred bytes
+SUB_BUCKETS = 64
+MIN_EXPONENT = -10
+MAX_EXPONENT = 31
+
+class LatencyHistogram:
+    def __init__(self):
+        # bucket index -> count
+        self.counts = {}
+        # values <= 0 (same millisecond) have their own bucket
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+# maps a positive value to its bucket
+    def bucket_index(self, value):
+        mantissa, exponent = math.frexp(value)
+        exponent = min(max(exponent, MIN_EXPONENT), MAX_EXPONENT)
+        sub_bucket = min(int((mantissa - 0.5) * 2 * SUB_BUCKETS), SUB_BUCKETS - 1)
+        return (exponent - MIN_EXPONENT) * SUB_BUCKETS + max(sub_bucket, 0)
+# middle of a bucket, what percentiles report
+    def bucket_value(self, index):
+        exponent, sub_bucket = divmod(index, SUB_BUCKETS)
+        return math.ldexp(0.5 + (sub_bucket + 0.5) / (2 * SUB_BUCKETS), exponent + MIN_EXPONENT)
+
+    def record(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zero_count += 1
+        else:
+            index = self.bucket_index(value)
+            self.counts[index] = self.counts.get(index, 0) + 1
+
+# adds another histograms counts into this one, used to combine results from several processes
+    def merge(self, other):
+        for index, bucket_count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + bucket_count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+# p is a percentage, percentile(99.9) is p999, the result is clamped to the real min/max
+    def percentile(self, p):
+        if not self.count:
+            return 0
+        rank = max(1, math.ceil(self.count * p / 100))
+        if rank <= self.zero_count:
+            return max(self.min, 0)
+        seen = self.zero_count
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(max(self.bucket_value(index), self.min), self.max)
+        return self.max
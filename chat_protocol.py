@@ -0,0 +1,125 @@
+import struct
+
+# binary framing shared by the server and the client
+# header: version, flags, seq, ack, payload length then the utf-8 payload
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct("!BBIIH")
+HEADER_SIZE = HEADER.size
+SEQ_MASK = 0xFFFFFFFF
+pack_header = HEADER.pack
+unpack_header = HEADER.unpack_from
+
+# an ack packet carries the next expected seq, with FLAG_SACK the payload is a bitmap of what arrived past the gap,
+# a big endian number as many bytes long as its highest bit needs, so it covers the whole receive window
+# delayed acks: ack every ACK_EVERY packets or after ACK_DELAY seconds, whichever comes first
+ACK_EVERY = 8
+ACK_DELAY = 0.02
+
+# header flags
+FLAG_ACK = 0x01
+FLAG_SACK = 0x02
+# the payload is several complete packets back to back
+FLAG_BATCH = 0x04
+# the payload is one piece of a message too big for a datagram, see fragmentation.py
+FLAG_FRAG = 0x08
+# the payload (the whole message for fragments) is deflated with the dictionary agreed on at USERNAME, see chat_compression.py
+FLAG_COMPRESSED = 0x10
+# from the server: there is no session for this address (it expired or the server restarted), start over from
+# seq 0 with a new login, ack carries the seq of the packet that got it
+FLAG_RESET = 0x20
+# never on the wire, parse_packet sets it when the peer used the old "seq|ack|message" text framing
+FLAG_LEGACY_TEXT = 0x80
+
+# builds a binary packet, message can be str or bytes
+# packing the header and adding the payload is two small allocations, packing into a bytearray made for the
+# packet or reused per thread measured about twice as slow
+def create_packet(sequence_num, ack_num, message, flags=0):
+    if isinstance(message, str):
+        message = message.encode()
+    return pack_header(PROTOCOL_VERSION, flags, sequence_num & SEQ_MASK, ack_num & SEQ_MASK, len(message)) + message
+# rewrites the header at the front of a preallocated packet buffer, used to send one payload to many peers
+def write_header(buffer, sequence_num, ack_num, length, flags=0):
+    HEADER.pack_into(buffer, 0, PROTOCOL_VERSION, flags, sequence_num & SEQ_MASK, ack_num & SEQ_MASK, length)
+# the old text framing, still used when talking to text peers
+def create_text_packet(sequence_num, ack_num, message):
+    return f"{sequence_num}|{ack_num}|{message}".encode()
+# parses either framing, the payload is sliced out once as bytes, which is cheaper than a memoryview for chat sized
+# payloads and is what the receivers keep or decode anyway
+# returns (seq, ack, flags, payload) or None if the packet is garbage
+def parse_packet(packet):
+    if len(packet) >= HEADER_SIZE and packet[0] == PROTOCOL_VERSION:
+        version, flags, seq_num, ack_num, length = unpack_header(packet)
+        end = HEADER_SIZE + length
+        if end > len(packet):
+            return None
+        return seq_num, ack_num, flags, packet[HEADER_SIZE:end]
+    return parse_text_packet(packet)
+# text packets start with a digit so they never collide with the version byte
+def parse_text_packet(packet):
+    first = packet.find(b"|")
+    second = packet.find(b"|", first + 1) if first >= 0 else -1
+    if second < 0:
+        return None
+    try:
+        seq_num = int(packet[:first])
+        ack_num = int(packet[first + 1:second])
+    except ValueError:
+        return None
+    return seq_num, ack_num, FLAG_LEGACY_TEXT, packet[second + 1:]
+# one ack covering everything below next_expected, bit i of sack_bits means next_expected + 1 + i arrived too
+def create_ack_packet(next_expected, sack_bits=0):
+    if sack_bits:
+        bitmap = sack_bits.to_bytes((sack_bits.bit_length() + 7) // 8, "big")
+        return create_packet(0, next_expected, bitmap, FLAG_ACK | FLAG_SACK)
+    return create_packet(0, next_expected, b"", FLAG_ACK)
+# tells a client its session is gone, see FLAG_RESET
+def create_reset_packet(seq_num):
+    return create_packet(0, seq_num, b"", FLAG_RESET)
+# pulls the bitmap back out of an ack packet, 0 if there isnt one
+def parse_sack(flags, payload):
+    if flags & FLAG_SACK:
+        return int.from_bytes(payload, "big")
+    return 0
+# wraps complete packets into one datagram
+def create_batch_packet(packets):
+    body = b"".join(packets)
+    return pack_header(PROTOCOL_VERSION, FLAG_BATCH, 0, 0, len(body)) + body
+# every (seq, ack, flags, payload) in a datagram as a list, one for a normal packet or each packet inside a batch,
+# the packets of a batch are read straight out of the datagram so each payload is only copied once
+def iter_packets(packet):
+    # same as parse_packet, inline since this runs for every datagram, a text packet shorter than a header
+    # (or empty) is the only thing that raises here
+    try:
+        version, flags, seq_num, ack_num, length = unpack_header(packet)
+    except struct.error:
+        version = None
+    if version != PROTOCOL_VERSION:
+        parsed = parse_text_packet(packet)
+        return [parsed] if parsed is not None else []
+    body_end = HEADER_SIZE + length
+    if body_end > len(packet):
+        return []
+    if not flags & FLAG_BATCH:
+        return [(seq_num, ack_num, flags, packet[HEADER_SIZE:body_end])]
+    packets = []
+    offset = HEADER_SIZE
+    while offset + HEADER_SIZE <= body_end:
+        version, flags, seq_num, ack_num, length = unpack_header(packet, offset)
+        end = offset + HEADER_SIZE + length
+        if version != PROTOCOL_VERSION or end > body_end:
+            break
+        packets.append((seq_num, ack_num, flags, packet[offset + HEADER_SIZE:end]))
+        offset = end
+    return packets
+# the sequence numbers a sack bitmap confirms below end, the senders next_seq, so a peer sending a bitmap
+# longer than the window only costs the bits that can mean something
+def sacked_sequences(next_expected, sack_bits, end):
+    if end <= next_expected + 1:
+        return
+    sack_bits &= (1 << (end - next_expected - 1)) - 1
+    seq_num = next_expected + 1
+    while sack_bits:
+        if sack_bits & 1:
+            yield seq_num
+        sack_bits >>= 1
+        seq_num += 1
@@ -1,102 +1,351 @@
 import socket
 import threading
 import time
-import random
+import math
+import traceback
+import argparse
+import itertools
+import asyncio
+import os
+import signal
+import tempfile
+import multiprocessing
+from collections import deque
+from retransmit_scheduler import RetransmitScheduler
+from batching import PacketBatcher
+from fragmentation import split_payload, ReassemblyBudget, MAX_MESSAGE_SIZE
+from client_session import ClientSession
+from chat_metrics import LatencyHistogram
+from room_bus import RoomBus
+from seq_window import unwrap_seq
+from room_history import RoomHistory
+from server_stats import ServerStats, StatsServer
+from datagram_capture import CaptureWriter
+from chat_protocol import (create_packet, create_text_packet, iter_packets, create_ack_packet, create_reset_packet,
+                           parse_sack, sacked_sequences, write_header, FLAG_ACK, FLAG_FRAG, FLAG_COMPRESSED,
+                           FLAG_LEGACY_TEXT, HEADER_SIZE, SEQ_MASK, ACK_EVERY, ACK_DELAY)
+from chat_compression import PayloadCompressor, pick_dictionary, COMPRESSION_THRESHOLD
 max_packet = 4096
+# receive buffer, bigger than anything we send so an old client's long message isnt cut off
+max_datagram = 65535
 window_size = 100
 ack_timeout = 1.0
+ack_every = ACK_EVERY
+ack_delay = ACK_DELAY
+# packets waiting for room in a clients send window, the oldest whole messages are dropped past this
+max_outbound_queue = 1024
+# coalesces packets per client when --batch-delay-ms is set, None sends every packet on its own
+outbound_batcher = None
+# ids for fragmented messages, shared by every client so one split can be queued to a whole room
+message_ids = itertools.count()
 
-#packetloss for random loss profile
-packet_loss = False
-small_loss=.05
-big_loss =.10
-
-thread_lock = threading.Lock()
+# locking: every client session has its own lock for its windows, buffers and metrics and a deliver_lock
+# that keeps its commands running one at a time in order, every room has its own lock for its member set
+# clients_lock and rooms_lock only cover adding and removing entries, timer_lock only covers the two schedulers
+# order is deliver_lock -> room lock -> client lock -> clients_lock -> timer_lock, two client locks are never held together
+# a client is only removed while its lock is held, so whoever holds it can tell whether the session is still current
+clients_lock = threading.Lock()
+rooms_lock = threading.Lock()
+timer_lock = threading.Lock()
 
 client_usernames = {}  
 chat_rooms = {}        
-client_states = {}     
-client_metrics = {}    
+# room -> tuple of member addresses, rebuilt on join/leave so fan-out can read it without the lock
+room_members = {}
+room_locks = {}
+client_sessions = {}
 max_clients_connected = 0
+# deadlines for everything sitting in a send window, keyed by (client_addr, seq_num)
+retransmit_timers = RetransmitScheduler()
+# delayed ack deadlines, keyed by client_addr
+ack_timers = RetransmitScheduler()
+# when each session goes idle, keyed by client_addr, a session that was heard from since is pushed back instead of dropped
+idle_timers = RetransmitScheduler()
+# when the oldest unfinished fragmented message of a client gives up, keyed by client_addr
+reassembly_timers = RetransmitScheduler()
+# bytes every client together may hold in half reassembled messages, set by --max-reassembly-mb
+reassembly_budget = ReassemblyBudget()
+# sessions with no datagram for this long are dropped, clients send keepalives well inside it, 0 never drops them
+idle_timeout = 60.0
+# with --workers every process owns the clients the kernel sends to its socket and the RoomBus links it to the others
+room_bus = None
+worker_id = 0
+# members that live on other workers: room -> {client_addr: worker}, changed under the rooms lock
+remote_members = {}
+remote_usernames = {}
+# set when a timer is armed so the threaded retransmit loop stops sleeping early
+timer_wakeup = threading.Event()
+# what was said in every room, on disk, None unless --history-dir is given
+room_history = None
+# messages replayed to a client when it joins a room, and the most one HISTORY command gets
+history_on_join = 20
+history_max_replay = 500
+# how often the timer runs the history retention sweep, and when it runs next
+history_sweep_interval = 60.0
+history_sweep_due = 0.0
+# server wide counters and stage timings, served on --stats-port
+stats = ServerStats()
+# clients that offer compression at USERNAME get it unless --compression off, payloads under the threshold stay plain
+compression_enabled = True
+compress_threshold = COMPRESSION_THRESHOLD
+# dictionary name -> PayloadCompressor, shared by every client that agreed on that dictionary
+compressors = {}
+# CaptureWriter that records every datagram read with --capture, for replay_capture.py
+capture = None
 #time for later calc
 def current_time_millis():
     return int(time.time() * 1000)
 
 
-def create_packet(sequence_num, ack_num, message):
-    return f"{sequence_num}|{ack_num}|{message}".encode()
-#decodes the packet 
-def decode_packet(packet_bytes):
-    try:
-        parts = packet_bytes.decode().split("|", 2)
-        seq_num = int(parts[0])
-        ack_num = int(parts[1])
-        payload = parts[2]
-        return seq_num, ack_num, payload #payload is bassically the message being sent
-    except Exception:
-        return None, None, None
-#sending the packet
-def send_packet(sock, client_addr, sequence_num, ack_num, message):
-    packet = create_packet(sequence_num, ack_num, message)
-    sock.sendto(packet, client_addr)
+# builds the packet in whatever framing the client talks, old text clients get text back
+def frame_packet(client_addr, sequence_num, ack_num, message, flags=0):
+    session = client_sessions.get(client_addr)
+    if session is not None and session.legacy_text:
+        return create_text_packet(sequence_num, ack_num, message)
+    return create_packet(sequence_num, ack_num, message, flags)
+# sends one packet to a binary client, through the batcher when batching is on
+def transmit(sock, packet, client_addr):
+    stats.packets_sent += 1
+    stats.bytes_sent += len(packet)
+    if outbound_batcher is None:
+        sock.sendto(packet, client_addr)
+    elif outbound_batcher.send(sock, client_addr, packet):
+        timer_wakeup.set()
+# sends the (seq, ack, payload, flags) frames a helper built while holding the clients lock, called after the lock is released
+# a seq of None means an old text client, they get one unsequenced text packet
+def send_frames(sock, client_addr, frames):
+    for seq_num, ack_num, payload, flags in frames:
+        if seq_num is None:
+            sock.sendto(create_text_packet(0, ack_num, payload.decode("utf-8")), client_addr)
+        else:
+            transmit(sock, create_packet(seq_num, ack_num, payload, flags), client_addr)
+# queues a message on the clients outbound stream and sends whatever the window allows
+def send_to_client(client_addr, message):
+    send_payload(client_addr, message.encode())
+# same for a message that is already encoded
+def send_payload(client_addr, payload):
+    session = client_sessions.get(client_addr)
+    if session is None:
+        return
+    parts = parts_for(session.compressor, payload, {})
+    with session.lock:
+        frames = queue_outbound(client_addr, session, payload, parts, time.time())
+    send_frames(server_socket, client_addr, frames)
+# the (payload, flags) packets one message goes out as, more than one when it doesnt fit in max_packet
+def outbound_parts(payload, flags=0):
+    fragments = split_payload(payload, next(message_ids) & SEQ_MASK, max_packet)
+    if not fragments:
+        return [(payload, flags)]
+    return [(fragment, FLAG_FRAG | flags) for fragment in fragments]
+# the parts of one message for a client with this compressor, cache is per message so a broadcast is
+# compressed and split once for every client using the same dictionary and once for the plain ones
+def parts_for(compressor, payload, cache):
+    key = None if compressor is None else compressor.name
+    parts = cache.get(key)
+    if parts is None:
+        data = compressor.compress(payload) if compressor is not None else None
+        if data is not None:
+            parts = outbound_parts(data, FLAG_COMPRESSED)
+        else:
+            # too short or did not shrink, same packets as for a plain client
+            parts = cache.get(None) or outbound_parts(payload)
+            cache[None] = parts
+        cache[key] = parts
+    return parts
+# a compressed payload back to text, "" (which runs nothing) when the client never agreed on compression,
+# the data does not inflate or it would inflate past the biggest message a client may send
+def inflate_payload(session, data):
+    compressor = session.compressor
+    payload = compressor.decompress(data, MAX_MESSAGE_SIZE) if compressor is not None else None
+    if payload is None:
+        stats.decompress_errors += 1
+        return ""
+    return payload.decode("utf-8", "replace")
+# puts an encoded message on the clients outbound queue, caller holds session.lock
+# returns the frames that fit in the window right now, nothing if the client quit in the meantime
+# deadlines is passed on to pump_outbound
+def queue_outbound(client_addr, session, payload, parts, now, deadlines=None):
+    if client_sessions.get(client_addr) is not session:
+        return []
+    if session.legacy_text:
+        return [(None, session.receive_window.expected - 1, payload, 0)]
+    add_outbound(session, parts)
+    if session.outbound_packets > max_outbound_queue:
+        drop_outbound(session)
+    return pump_outbound(client_addr, session, now, deadlines)
+# the queue is only there while something waits in it, an idle client does not hold an empty deque
+def add_outbound(session, parts):
+    if session.outbound_queue is None:
+        session.outbound_queue = deque()
+    session.outbound_queue.append(parts)
+    session.outbound_packets += len(parts)
+# a client that cant keep up loses its oldest queued messages, always whole ones and never one that is partly
+# sent, the newest message is always kept, caller holds the clients lock
+def drop_outbound(session):
+    outbound_queue = session.outbound_queue
+    while session.outbound_packets > max_outbound_queue:
+        oldest = 1 if session.outbound_sent else 0
+        if oldest >= len(outbound_queue) - 1:
+            return
+        session.outbound_packets -= len(outbound_queue[oldest])
+        del outbound_queue[oldest]
+        session.undelivered += 1
+        session.metrics.outbound_dropped += 1
+        stats.outbound_dropped += 1
+# tells the client how many messages it missed once the backlog has been sent, caller holds the clients lock
+def report_undelivered(session):
+    notice = f"[Server] {session.undelivered} messages to you were dropped because they could not be sent fast enough"
+    add_outbound(session, parts_for(session.compressor, notice.encode(), {}))
+    session.undelivered = 0
+# moves queued payloads into the send window while there is room, caller holds the clients lock
+# the window is the smaller of window_size and the clients cwnd, and a hole at the front of the ring
+# stops it too, returns the frames to send
+# the retransmit timers are armed here unless a deadlines list is given, then (client_addr, frames, deadline)
+# is added to it and the caller arms them with schedule_retransmits before sending
+def pump_outbound(client_addr, session, now, deadlines=None):
+    frames = []
+    if session.undelivered and not session.outbound_queue:
+        report_undelivered(session)
+    outbound_queue = session.outbound_queue
+    send_window = session.send_window
+    space = min(min(window_size, session.cwnd.window()) - len(send_window), send_window.room())
+    if not outbound_queue or space <= 0:
+        return frames
+    ack_num = session.receive_window.expected
+    while outbound_queue and space > 0:
+        parts = outbound_queue[0]
+        payload, flags = parts[session.outbound_sent]
+        session.outbound_sent += 1
+        if session.outbound_sent == len(parts):
+            outbound_queue.popleft()
+            session.outbound_sent = 0
+        session.outbound_packets -= 1
+        seq_num = send_window.add((payload, flags, now, 0))
+        frames.append((seq_num, ack_num, payload, flags))
+        space -= 1
+    if not outbound_queue:
+        session.outbound_queue = None
+    if deadlines is not None:
+        deadlines.append((client_addr, frames, now + session.rtt.rto))
+    else:
+        schedule_retransmits([(client_addr, frames, now + session.rtt.rto)])
+    return frames
+# arms the retransmit timers for frames pump_outbound took, all under one hold of the timer lock
+def schedule_retransmits(deadlines):
+    schedule = retransmit_timers.schedule
+    with timer_lock:
+        for client_addr, frames, deadline in deadlines:
+            for frame in frames:
+                schedule((client_addr, frame[0]), deadline)
 #sending the acknowledgment
 def send_ack(sock, client_addr, ack_num):
-    packet = create_packet(0, ack_num, "")
+    packet = frame_packet(client_addr, 0, ack_num, "", FLAG_ACK)
     sock.sendto(packet, client_addr)
-# starts tracking the metrics for each client that joins
+# one cumulative ack + sack bitmap for everything buffered so far, caller holds the clients lock
+def send_cumulative_ack(sock, client_addr, session):
+    receive_window = session.receive_window
+    next_expected = receive_window.next_missing()
+    transmit(sock, create_ack_packet(next_expected, receive_window.sack_bits(next_expected)), client_addr)
+    session.acks_pending = 0
+    with timer_lock:
+        ack_timers.cancel(client_addr)
+    session.metrics.acks_sent += 1
+    stats.acks_sent += 1
+# text clients get an ack per datagram, binary clients get one ack every ack_every packets or after ack_delay
+# gaps and duplicates are acked straight away so the sender finds out quickly
+def acknowledge(sock, client_addr, session, seq_num, urgent):
+    if session.legacy_text:
+        send_ack(sock, client_addr, seq_num)
+        session.metrics.acks_sent += 1
+        stats.acks_sent += 1
+        return
+    session.acks_pending += 1
+    if urgent or session.acks_pending >= ack_every:
+        send_cumulative_ack(sock, client_addr, session)
+    else:
+        with timer_lock:
+            if client_addr in ack_timers:
+                return
+            ack_timers.schedule(client_addr, time.time() + ack_delay)
+        timer_wakeup.set()
+# sends the acks whose delay ran out
+def flush_delayed_acks(sock):
+    with timer_lock:
+        expired = ack_timers.pop_expired(time.time())
+    for client_addr in expired:
+        session = client_sessions.get(client_addr)
+        if session is None:
+            continue
+        with session.lock:
+            if session.acks_pending:
+                send_cumulative_ack(sock, client_addr, session)
+# starts a session for each new client address, returns the session
 def initialize_client(client_addr):
     global max_clients_connected
-    with thread_lock:
-        if client_addr not in client_states:
-            client_states[client_addr] = {
-                "expected_sequence": 0,
-                "out_of_order_buffer": {},
-                "send_window": {},
-            }
-            client_metrics[client_addr] = {
-                "retransmissions_count": 0,
-                "out_of_order_count": 0,
-                "latency_list": [],
-                "messages_received": 0,
-                "bytes_received": 0,
-                "start_timestamp": None,
-                "end_timestamp": None,
-                "total_packets_received": 0,
-                "acks_received": set(),
-            }
-        max_clients_connected = max(max_clients_connected, len(client_states))
+    session = client_sessions.get(client_addr)
+    if session is not None:
+        return session
+    with clients_lock:
+        session = client_sessions.get(client_addr)
+        if session is None:
+            session = client_sessions[client_addr] = ClientSession(ack_timeout, window_size, reassembly_budget=reassembly_budget)
+            if idle_timeout:
+                with timer_lock:
+                    idle_timers.schedule(client_addr, session.last_seen + idle_timeout)
+        max_clients_connected = max(max_clients_connected, len(client_sessions))
+    return session
 # latency metric
-def latency_metrics(client_addr, packet_recv_time):
-    if client_addr not in client_metrics:
-        return
+def latency_metrics(session, packet_recv_time):
     now = current_time_millis()
     latency = now - packet_recv_time
-    client_metrics[client_addr]["latency_list"].append(latency)
+    session.metrics.record_latency(latency)
 # if a messahe is sount out of order this fixes it
+# deliver_lock keeps commands in order when two threads got packets from the same client, the clients
+# lock is only held to take the next message off the buffer so a command can send to other clients
 def deliver_ordered_messages(client_addr):
-    state = client_states.get(client_addr)
-    if not state:
+    session = client_sessions.get(client_addr)
+    if not session:
         return
 
-    expected_seq = state["expected_sequence"]
-
-    while expected_seq in state["out_of_order_buffer"]:
-        payload, recv_time = state["out_of_order_buffer"].pop(expected_seq)
+    with session.deliver_lock:
+        while True:
+            started = stats.start()
+            with session.lock:
+                entry = session.receive_window.pop()
+                if entry is None:
+                    return
+                payload, recv_time, flags = entry
+                if flags & FLAG_FRAG:
+                    # nothing to run until the last fragment of the message is in
+                    reassembler = session.get_reassembler()
+                    payload = reassembler.add(payload)
+                    if payload is None:
+                        if reassembler.messages and client_addr not in reassembly_timers:
+                            with timer_lock:
+                                reassembly_timers.schedule(client_addr, reassembler.oldest() + reassembler.timeout)
+                        continue
+                if flags & FLAG_COMPRESSED:
+                    # inflated only now, one message at a time, so the window never holds more than the wire bytes
+                    payload = inflate_payload(session, payload)
+                elif flags & FLAG_FRAG:
+                    payload = payload.decode("utf-8", "replace")
+            stats.stop("ordering", started)
 
-        process_chat_command(client_addr, payload)
-        # updating metrics
-        latency_metrics(client_addr, recv_time)
+            stats.messages_delivered += 1
+            started = stats.start()
+            process_chat_command(client_addr, payload)
+            stats.stop("command", started)
 
-        if client_addr in client_metrics:
-            metrics = client_metrics[client_addr]
-            metrics["messages_received"] += 1
-            metrics["bytes_received"] += len(payload)
-            if metrics["start_timestamp"] is None:
-                metrics["start_timestamp"] = recv_time
-            metrics["end_timestamp"] = current_time_millis()
+            with session.lock:
+                # updating metrics
+                latency_metrics(session, recv_time)
 
-        state["expected_sequence"] += 1
-        expected_seq = state["expected_sequence"]
+                metrics = session.metrics
+                metrics.messages_received += 1
+                metrics.bytes_received += len(payload)
+                if metrics.start_timestamp is None:
+                    metrics.start_timestamp = recv_time
+                metrics.end_timestamp = current_time_millis()
 # gets the required information from the client in order to execute the command
 def process_chat_command(client_addr, message):
     parts = message.strip().split()
@@ -109,23 +358,43 @@ def process_chat_command(client_addr, message):
 # username command
     if command == "USERNAME" and args:
         username = args[0]
-        with thread_lock:
-            client_usernames[client_addr] = username
-        send_packet(server_socket, client_addr, 0, client_states[client_addr]["expected_sequence"] - 1,
-                    f"[Server] Welcome {username}!")
+        client_usernames[client_addr] = username
+        publish_event(["username", client_addr, username])
+        # USERNAME <name> compress=<dictionary>,... offers compression, the welcome goes out plain and says which
+        # dictionary was picked, everything after it may come compressed and the client compresses once it saw it
+        name = pick_dictionary(args[1:]) if compression_enabled else None
+        session = client_sessions.get(client_addr)
+        if name is None or session is None:
+            send_to_client(client_addr, f"[Server] Welcome {username}!")
+        else:
+            compressor = compressors.get(name)
+            if compressor is None:
+                compressor = compressors.setdefault(name, PayloadCompressor(name, compress_threshold))
+            welcome = f"[Server] Welcome {username}! (compression {name})".encode()
+            # set before the welcome leaves so a reply to it can already be inflated
+            with session.lock:
+                frames = queue_outbound(client_addr, session, welcome, outbound_parts(welcome), time.time())
+                session.compressor = compressor
+            send_frames(server_socket, client_addr, frames)
         print(f"[Server] Registered username '{username}' from {client_addr}")
 # join command
     elif command == "JOIN" and args:
         room_name = args[0]
-        with thread_lock:
+        with room_lock(room_name):
             chat_rooms.setdefault(room_name, set()).add(client_addr)
+            update_room_index(room_name)
+        publish_event(["join", room_name, client_addr, username])
+        # the room so far comes before the join notice so the client sees it in the order it was said
+        send_history(client_addr, room_name, history_on_join)
         broadcast_message(room_name, f"[Server] {username} joined {room_name}")
 # leave command
     elif command == "LEAVE" and args:
         room_name = args[0]
-        with thread_lock:
+        with room_lock(room_name):
             if room_name in chat_rooms and client_addr in chat_rooms[room_name]:
                 chat_rooms[room_name].remove(client_addr)
+                update_room_index(room_name)
+        publish_event(["leave", room_name, client_addr])
         broadcast_message(room_name, f"[Server] {username} left {room_name}")
 # msg command
     elif command == "MSG" and len(args) >= 2:
@@ -135,91 +404,394 @@ def process_chat_command(client_addr, message):
 # who command
     elif command == "WHO" and args:
         room_name = args[0]
-        with thread_lock:
-            members = [client_usernames.get(c_addr, "?") for c_addr in chat_rooms.get(room_name, set())]
-        send_packet(server_socket, client_addr, 0, client_states[client_addr]["expected_sequence"] - 1,
-                    f"[Server] Users in {room_name}: {', '.join(members)}")
+        members = [client_usernames.get(c_addr, "?") for c_addr in room_members.get(room_name, ())]
+        members += [remote_usernames.get(c_addr, "?") for c_addr in list(remote_members.get(room_name, ()))]
+        send_to_client(client_addr, f"[Server] Users in {room_name}: {', '.join(members)}")
+# history command, HISTORY <room> [n|since]
+    elif command == "HISTORY" and args:
+        room_name = args[0]
+        if room_history is None:
+            send_to_client(client_addr, "[Server] History is off")
+            return
+        limit, since = parse_history_range(args[1] if len(args) > 1 else None)
+        if limit is None:
+            send_to_client(client_addr, "[Server] Usage: HISTORY <room> [count | 10m | unix time]")
+            return
+        if not send_history(client_addr, room_name, limit, since):
+            send_to_client(client_addr, f"[Server] No history for {room_name}")
 # rooms command
     elif command == "ROOMS":
-        with thread_lock:
-            room_info = [f"{room} ({len(members)})" for room, members in chat_rooms.items()]
-        send_packet(server_socket, client_addr, 0, client_states[client_addr]["expected_sequence"] - 1,
-                    f"[Server] Active rooms: {', '.join(room_info)}")
+        counts = {room: len(members) for room, members in list(chat_rooms.items())}
+        for room, members in list(remote_members.items()):
+            counts[room] = counts.get(room, 0) + len(members)
+        room_info = [f"{room} ({count})" for room, count in counts.items()]
+        send_to_client(client_addr, f"[Server] Active rooms: {', '.join(room_info)}")
 # quit command
     elif command == "QUIT":
         print(f"[Server] User '{username}' disconnected")
         print_client_metrics(client_addr)
-
-        with thread_lock:
-            client_usernames.pop(client_addr, None)
-            for members in chat_rooms.values():
-                members.discard(client_addr)
-            client_states.pop(client_addr, None)
-            client_metrics.pop(client_addr, None)
+        remove_client(client_addr)
 
     else:
-        send_packet(server_socket, client_addr, 0, client_states[client_addr]["expected_sequence"] - 1,
-                    "[Server] Unknown command")
+        send_to_client(client_addr, "[Server] Unknown command")
+# HISTORY takes a message count, an age like 30s, 10m or 2h, or a unix time, returns (limit, since)
+def parse_history_range(text):
+    if text is None:
+        return history_on_join or history_max_replay, 0.0
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    try:
+        if text[-1:].lower() in units:
+            age = float(text[:-1]) * units[text[-1].lower()]
+            if not math.isfinite(age):
+                return None, 0.0
+            return history_max_replay, time.time() - age
+        value = float(text)
+    except ValueError:
+        return None, 0.0
+    # nan and inf parse as floats but are no count or time
+    if not math.isfinite(value):
+        return None, 0.0
+    if value >= 1e9:
+        return history_max_replay, value
+    if value < 1:
+        return None, 0.0
+    return min(int(value), history_max_replay), 0.0
+# replays a rooms history to one client straight from the log, as many messages per datagram as fit in
+# max_packet, returns how many messages went out
+def send_history(client_addr, room_name, limit, since=0.0):
+    if room_history is None or limit <= 0:
+        return 0
+    try:
+        records = room_history.replay(room_name, limit, since)
+    except OSError as e:
+        stats.history_errors += 1
+        print("[Server] History error:", e)
+        return 0
+    if not records:
+        return 0
+    send_to_client(client_addr, f"[Server] Last {len(records)} messages in {room_name}:")
+    batch = []
+    size = 0
+    for record in records:
+        if batch and size + 1 + len(record) > max_packet:
+            send_payload(client_addr, b"\n".join(batch))
+            batch = []
+            size = 0
+        batch.append(record)
+        size += len(record) + 1
+    send_payload(client_addr, b"\n".join(batch))
+    return len(records)
+# forgets a client that quit or went idle: its rooms, its session and every timer it still had
+def remove_client(client_addr):
+    client_usernames.pop(client_addr, None)
+    publish_event(["quit", client_addr])
+    for room_name, members in list(chat_rooms.items()):
+        if client_addr in members:
+            with room_lock(room_name):
+                members.discard(client_addr)
+                update_room_index(room_name)
+    session = client_sessions.get(client_addr)
+    if session is None:
+        return
+    with session.lock:
+        with clients_lock:
+            client_sessions.pop(client_addr, None)
+        if session.reassembler is not None:
+            session.reassembler.clear()
+        with timer_lock:
+            for seq_num in session.send_window:
+                retransmit_timers.cancel((client_addr, seq_num))
+            ack_timers.cancel(client_addr)
+            idle_timers.cancel(client_addr)
+            reassembly_timers.cancel(client_addr)
+# drops sessions that have not sent anything for idle_timeout, only sessions whose deadline is up are looked at
+# and one that was heard from since is just rescheduled, so the sweep costs nothing for active clients
+def expire_idle_clients():
+    now = time.time()
+    with timer_lock:
+        expired = idle_timers.pop_expired(now)
+    for client_addr in expired:
+        session = client_sessions.get(client_addr)
+        if session is None:
+            continue
+        if session.legacy_text:
+            # old text clients send no keepalives and cannot be told to log in again, they are never expired
+            continue
+        idle_until = session.last_seen + idle_timeout
+        if idle_until > now:
+            with timer_lock:
+                idle_timers.schedule(client_addr, idle_until)
+            continue
+        print(f"[Server] User '{client_usernames.get(client_addr, '?')}' timed out after {now - session.last_seen:.0f}s idle")
+        stats.clients_expired += 1
+        remove_client(client_addr)
+# drops fragmented messages whose missing pieces never came, so they stop holding the reassembly budget
+# without waiting for the client to start another message
+def expire_reassembly():
+    now = time.time()
+    with timer_lock:
+        expired = reassembly_timers.pop_expired(now)
+    for client_addr in expired:
+        session = client_sessions.get(client_addr)
+        if session is None:
+            continue
+        with session.lock:
+            reassembler = session.reassembler
+            if reassembler is None:
+                continue
+            reassembler.expire(now)
+            if reassembler.messages:
+                with timer_lock:
+                    reassembly_timers.schedule(client_addr, reassembler.oldest() + reassembler.timeout)
 #brodacast the mesage to other users
+# the lock for one room, made the first time the room is used
+def room_lock(room_name):
+    lock = room_locks.get(room_name)
+    if lock is None:
+        with rooms_lock:
+            lock = room_locks.setdefault(room_name, threading.Lock())
+    return lock
+# rebuilds the member tuple fan-out reads, caller holds the rooms own lock
+def update_room_index(room_name):
+    members = chat_rooms.get(room_name)
+    if members:
+        room_members[room_name] = tuple(members)
+    else:
+        room_members.pop(room_name, None)
+# sends to everyone in the room, with --workers the workers that have members in it get it over the bus
+# with history on every worker gets it so each one has the whole room in its own log
 def broadcast_message(room_name, message, exclude_addr=None):
-    with thread_lock:
-        for client_addr in list(chat_rooms.get(room_name, set())):
-            if client_addr != exclude_addr:
-                send_packet(server_socket, client_addr, 0,
-                            client_states[client_addr]["expected_sequence"] - 1, message)
+    record_history(room_name, message)
+    broadcast_local(room_name, message, exclude_addr)
+    if room_bus is not None:
+        if room_history is not None:
+            room_bus.publish(["broadcast", room_name, message])
+            return
+        workers = set(list(remote_members.get(room_name, {}).values()))
+        if workers:
+            room_bus.publish(["broadcast", room_name, message], workers)
+# logs a room message, only rooms someone is in get a log so made up room names cost no files,
+# a disk or file descriptor problem loses the history entry and nothing else
+def record_history(room_name, message):
+    if room_history is None:
+        return
+    if not room_members.get(room_name) and not remote_members.get(room_name):
+        return
+    try:
+        room_history.append(room_name, message)
+    except OSError as e:
+        stats.history_errors += 1
+        print("[Server] History error:", e)
+# each recipient gets it on its own outbound stream so a slow one only backs up its own queue
+# the message is encoded once, the member list is a snapshot so no room lock is needed, each recipients
+# lock is only held while its own bookkeeping is done, the timer lock is taken once for the whole room
+# and the sends happen after
+def broadcast_local(room_name, message, exclude_addr=None):
+    started = stats.start()
+    payload = message.encode()
+    cache = {}
+    sends = []
+    deadlines = []
+    now = time.time()
+    for client_addr in room_members.get(room_name, ()):
+        if client_addr == exclude_addr:
+            continue
+        session = client_sessions.get(client_addr)
+        if session is None:
+            continue
+        parts = parts_for(session.compressor, payload, cache)
+        with session.lock:
+            sends.append((client_addr, queue_outbound(client_addr, session, payload, parts, now, deadlines)))
+    schedule_retransmits(deadlines)
+    fan_out(server_socket, sends)
+    stats.broadcasts += 1
+    stats.fanout_recipients += len(sends)
+    stats.stop("fanout", started)
+# tells the other workers about a membership change, does nothing in single process mode
+def publish_event(event):
+    if room_bus is not None:
+        room_bus.publish(event)
+# an event from another worker, runs on that workers bus reader thread so events from one worker stay in order
+def handle_bus_event(from_worker, event):
+    kind = event[0]
+    if kind == "broadcast":
+        record_history(event[1], event[2])
+        broadcast_local(event[1], event[2])
+    elif kind == "join":
+        room_name, client_addr = event[1], tuple(event[2])
+        remote_usernames[client_addr] = event[3]
+        with room_lock(room_name):
+            remote_members.setdefault(room_name, {})[client_addr] = from_worker
+    elif kind == "leave":
+        with room_lock(event[1]):
+            remote_members.get(event[1], {}).pop(tuple(event[2]), None)
+    elif kind == "username":
+        remote_usernames[tuple(event[1])] = event[2]
+    elif kind == "quit":
+        client_addr = tuple(event[1])
+        for room_name, members in list(remote_members.items()):
+            if client_addr in members:
+                with room_lock(room_name):
+                    members.pop(client_addr, None)
+        remote_usernames.pop(client_addr, None)
+# sends payloads that are shared between clients, each one is copied into a packet buffer once
+# and only the header is rewritten per recipient
+def fan_out(sock, sends):
+    templates = {}
+    for client_addr, frames in sends:
+        for frame in frames:
+            seq_num, ack_num, payload, flags = frame
+            if seq_num is None:
+                send_frames(sock, client_addr, (frame,))
+                continue
+            template = templates.get(id(payload))
+            if template is None:
+                template = bytearray(HEADER_SIZE + len(payload))
+                template[HEADER_SIZE:] = payload
+                templates[id(payload)] = template
+            write_header(template, seq_num, ack_num, len(payload), flags)
+            transmit(sock, template, client_addr)
 # this code retansmits packets that havent been sent 
 def retransmit_unacked_packets(sock):
     while True:
-        time.sleep(0.1)
-        with thread_lock:
-            for client_addr, state in client_states.items():
-                current_time = time.time()
-                send_window = state["send_window"]
-
-                for seq_num in list(send_window.keys()):
-                    message, last_sent_time, retrans_count = send_window[seq_num]
-
-                    if client_addr in client_metrics and seq_num in client_metrics[client_addr].get("acks_received", set()):
-                        continue  
+        timer_wakeup.wait(retransmit_delay())
+        timer_wakeup.clear()
+        service_timers(sock)
+# everything the timer loop does on each wake up
+def service_timers(sock):
+    retransmit_expired(sock)
+    flush_delayed_acks(sock)
+    expire_idle_clients()
+    expire_reassembly()
+    expire_history()
+    if outbound_batcher is not None:
+        outbound_batcher.flush_expired(sock)
+# drops expired history from every room once every history_sweep_interval, appends and replays only trim the room
+# they touch and never the segment being written to, so without this a quiet room would keep its log for ever
+def expire_history():
+    global history_sweep_due
+    if room_history is None:
+        return
+    now = time.time()
+    if now < history_sweep_due:
+        return
+    history_sweep_due = now + history_sweep_interval
+    try:
+        room_history.expire(now)
+    except OSError as e:
+        stats.history_errors += 1
+        print("[Server] History error:", e)
+# sleeps until the next deadline but wakes up at least every 100ms to pick up new packets
+def retransmit_delay():
+    with timer_lock:
+        now = time.time()
+        delay = min(retransmit_timers.time_until_next(now, 0.1), ack_timers.time_until_next(now, 0.1),
+                    idle_timers.time_until_next(now, 0.1), reassembly_timers.time_until_next(now, 0.1))
+    if outbound_batcher is not None:
+        delay = outbound_batcher.time_until_next(now, delay)
+    return delay
+# an ack came in so the packet leaves the window and its timer is cancelled, caller holds the clients lock
+# packets that were never retransmitted give an rtt sample and grow the congestion window
+def release_acked_packet(client_addr, seq_num):
+    with timer_lock:
+        retransmit_timers.cancel((client_addr, seq_num))
+    session = client_sessions.get(client_addr)
+    if session is None:
+        return
+    entry = session.send_window.remove(seq_num)
+    if entry is None:
+        return
+    on_packet_acked(session, entry, time.time())
+# packets that were never retransmitted give an rtt sample and every ack grows the congestion window
+def on_packet_acked(session, entry, now):
+    message, flags, last_sent_time, retrans_count = entry
+    if retrans_count == 0:
+        session.rtt.sample(now - last_sent_time)
+    session.cwnd.on_ack()
+# cumulative ack + sack bitmap, drops everything they cover from the send window at once
+# the cumulative part walks the ring from its base, no scan over the whole window
+def release_acked_packets(client_addr, next_expected, sack_bits):
+    session = client_sessions.get(client_addr)
+    if session is None:
+        return
+    send_window = session.send_window
+    now = time.time()
+    released = send_window.release_below(next_expected)
+    if released:
+        with timer_lock:
+            for seq_num, _ in released:
+                retransmit_timers.cancel((client_addr, seq_num))
+        for _, entry in released:
+            on_packet_acked(session, entry, now)
+    for seq_num in sacked_sequences(next_expected, sack_bits, send_window.next_seq):
+        if seq_num in send_window:
+            release_acked_packet(client_addr, seq_num)
+# resends only the packets whose timer ran out instead of walking every send window
+# each client is only locked while its own packet is looked at
+def retransmit_expired(sock):
+    resends = []
+    current_time = time.time()
+    with timer_lock:
+        expired = retransmit_timers.pop_expired(current_time)
+    if not expired:
+        return
+    started = stats.start()
+    for client_addr, seq_num in expired:
+        session = client_sessions.get(client_addr)
+        if session is None:
+            continue
+        with session.lock:
+            entry = session.send_window.get(seq_num)
+            if entry is None:
+                continue
+            message, flags, last_sent_time, retrans_count = entry
 
-                    if current_time - last_sent_time > ack_timeout:
-                        packet = create_packet(seq_num, state["expected_sequence"] - 1, message)
-                        if packet_loss and random.random() < random.uniform(small_loss, big_loss):
-                            sock.sendto(packet, client_addr)
-                        if client_addr in client_metrics:
-                            client_metrics[client_addr]["retransmissions_count"] += 1
-                        send_window[seq_num] = (message, current_time, retrans_count + 1)
-                        print(f"[Server] Retransmitted packet seq {seq_num} to {client_addr}")
+            session.rtt.timeout(last_sent_time, current_time)
+            session.cwnd.on_loss(seq_num, session.send_window.next_seq)
+            packet = create_packet(seq_num, session.receive_window.expected, message, flags)
+            resends.append((packet, client_addr))
+            session.metrics.retransmissions_count += 1
+            session.send_window.update(seq_num, (message, flags, current_time, retrans_count + 1))
+            with timer_lock:
+                retransmit_timers.schedule((client_addr, seq_num), current_time + session.rtt.rto)
+        print(f"[Server] Retransmitted packet seq {seq_num} to {client_addr}")
+    for packet, client_addr in resends:
+        transmit(sock, packet, client_addr)
+    stats.retransmissions += len(resends)
+    stats.stop("retransmit", started)
 #gets information for metrics
 def print_client_metrics(client_addr):
 
-    metrics = client_metrics.get(client_addr)
-    if not metrics:
+    session = client_sessions.get(client_addr)
+    if not session:
         print(f"No metrics for {client_addr}")
         return
+    metrics = session.metrics
 
-    latencies = metrics["latency_list"]
-    avg_latency = sum(latencies) / len(latencies) if latencies else 0
-
-    percentile_95 = 0
-    if len(latencies) >= 20:
-        sorted_lat = sorted(latencies)
-        percentile_95 = sorted_lat[int(len(latencies) * 0.95) - 1]
+    latencies = metrics.latency_histogram or LatencyHistogram()
+    avg_latency = latencies.mean()
 
-    start = metrics.get("start_timestamp")
-    end = metrics.get("end_timestamp")
+    start = metrics.start_timestamp
+    end = metrics.end_timestamp
     duration_sec = (end - start) / 1000 if start and end and end > start else 0
-    goodput = metrics.get("messages_received", 0) / duration_sec if duration_sec > 0 else 0
+    goodput = metrics.messages_received / duration_sec if duration_sec > 0 else 0
 
-    total_msgs = metrics.get("messages_received", 0)
-    out_of_order = metrics.get("out_of_order_count", 0)
+    total_msgs = metrics.messages_received
+    out_of_order = metrics.out_of_order_count
     out_of_order_pct = (out_of_order / total_msgs) * 100 if total_msgs else 0
 
     print("\n--- Metrics ---")
     print(f"Average latency (ms): {avg_latency:.2f}")
-    print(f"95th percentile latency (ms): {percentile_95:.2f}")
+    print(f"Latency p50/p95/p99/p999 (ms): {latencies.percentile(50):.2f} / {latencies.percentile(95):.2f}"
+          f" / {latencies.percentile(99):.2f} / {latencies.percentile(99.9):.2f}")
     print(f"Goodput (messages/sec): {goodput:.2f}")
     print(f"Out-of-order messages: {out_of_order} ({out_of_order_pct:.2f}%)")
+    print(f"ACKs sent: {metrics.acks_sent}")
+    print(f"Retransmissions: {metrics.retransmissions_count}")
+    print(f"Outbound messages dropped: {metrics.outbound_dropped}")
+    print(f"Packets outside the receive window: {metrics.rejected_packets}")
+    print(f"Congestion window: {session.cwnd.cwnd:.1f}")
+    print(f"RTO (ms): {session.rtt.rto * 1000:.1f}")
     print(f"Max concurrent clients: {max_clients_connected}")
     print("-------------------------------------")
 
@@ -227,53 +799,330 @@ def print_client_metrics(client_addr):
 def server_loop():
     while True:
         try:
-            packet, client_addr = server_socket.recvfrom(max_packet)
-            if packet_loss and random.random() < random.uniform(small_loss, big_loss):
-                continue
+            packet, client_addr = server_socket.recvfrom(max_datagram)
         except Exception as e:
             print("[Server] Socket error:", e)
             continue
-        initialize_client(client_addr)
+        # one bad datagram must not take the receive thread down, the asyncio loop does the same for its callbacks
+        try:
+            handle_datagram(packet, client_addr)
+        except Exception:
+            print(f"[Server] Error handling datagram from {client_addr}:")
+            traceback.print_exc()
+# handles one datagram from a client, shared by the threaded and asyncio engines
+# recv covers the whole datagram including the stages below it
+def handle_datagram(packet, client_addr):
+    if capture is not None:
+        capture.record(packet, client_addr)
+    started = stats.start()
+    stats.datagrams_received += 1
+    stats.bytes_received += len(packet)
+    decode_started = stats.start()
+    packets = iter_packets(packet)
+    stats.stop("decode", decode_started)
+    session = client_sessions.get(client_addr)
+    if session is None:
+        session = start_session(client_addr, packets)
+        if session is None:
+            stats.stop("recv", started)
+            return
+    session.last_seen = time.time()
 
-        seq_num, ack_num, payload = decode_packet(packet)
-        if seq_num is None:
-            continue
+    for seq_num, ack_num, flags, payload in packets:
+        handle_packet(client_addr, seq_num, ack_num, flags, payload)
+    stats.stop("recv", started)
+# a new address only gets a session when it starts at the beginning: a binary client with its data packet
+# seq 0, or an old text client from wherever it is (it does not order what we send, so only our side syncs up)
+# anything else comes from a client whose session expired or whose server restarted, its packets would be
+# acked but never run, so it gets a reset and logs in again from seq 0
+def start_session(client_addr, packets):
+    data = [(seq_num, flags) for seq_num, _, flags, _ in packets if not flags & FLAG_ACK]
+    legacy = [seq_num for seq_num, flags in data if flags & FLAG_LEGACY_TEXT]
+    if legacy:
+        session = initialize_client(client_addr)
+        with session.lock:
+            if not session.receive_window.buffered and session.metrics.total_packets_received == 0:
+                session.receive_window.expected = min(legacy)
+        return session
+    if any(seq_num == 0 for seq_num, _ in data):
+        return initialize_client(client_addr)
+    if packets:
+        stats.resets_sent += 1
+        transmit(server_socket, create_reset_packet(packets[0][0]), client_addr)
+    return None
+# handles one packet, a batch datagram comes through here once per packet inside it
+def handle_packet(client_addr, seq_num, ack_num, flags, payload):
+    session = client_sessions.get(client_addr)
+    if session is None:
+        return
 
-        state = client_states.get(client_addr)
-        if state is None:
-            continue
+    frames = None
+    with session.lock:
+        if client_sessions.get(client_addr) is not session:
+            # the client quit while this packet was waiting for the lock
+            return
+        session.legacy_text = bool(flags & FLAG_LEGACY_TEXT)
 
-        with thread_lock:
+        session.metrics.total_packets_received += 1
+        stats.packets_received += 1
+        # an ack packet carries no data so it never goes through ordering, it may open the window though
+        if flags & FLAG_ACK:
+            stats.ack_packets += 1
+            # the wire only has the low 32 bits, the ack is somewhere around the oldest unacked packet
+            ack_num = unwrap_seq(ack_num, session.send_window.base)
+            release_acked_packets(client_addr, ack_num, parse_sack(flags, payload))
+            frames = pump_outbound(client_addr, session, time.time())
+        else:
+            stats.data_packets += 1
+            if session.legacy_text:
+                release_acked_packet(client_addr, ack_num)
+            receive_data_packet(client_addr, session, unwrap_seq(seq_num, session.receive_window.expected), flags, payload)
 
-            client_metrics[client_addr]["acks_received"].add(ack_num)
-            client_metrics[client_addr]["total_packets_received"] += 1
+    if frames is not None:
+        send_frames(server_socket, client_addr, frames)
+        return
+    deliver_ordered_messages(client_addr)
+# buffers a data packet for ordering and acks it, caller holds the clients lock
+# only window_size packets past the next expected one are buffered, anything further out is dropped so a
+# client cannot make the server hold more than one window for it, duplicates and old packets are just acked again
+def receive_data_packet(client_addr, session, seq_num, flags, payload):
+    receive_window = session.receive_window
+    expected = receive_window.expected
+    if seq_num < expected or seq_num in receive_window:
+        stats.duplicate_packets += 1
+        acknowledge(server_socket, client_addr, session, seq_num, urgent=True)
+        return
+    if seq_num >= expected + receive_window.size:
+        session.metrics.rejected_packets += 1
+        stats.rejected_packets += 1
+        acknowledge(server_socket, client_addr, session, seq_num, urgent=True)
+        return
+    # the payload is only decoded once we know it is not a duplicate, fragments wait for the rest of the message
+    # and compressed payloads stay compressed until they are delivered
+    if flags & (FLAG_FRAG | FLAG_COMPRESSED):
+        message = payload
+    else:
+        message = payload.decode("utf-8", "replace")
+    receive_window.offer(seq_num, (message, current_time_millis(), flags & (FLAG_FRAG | FLAG_COMPRESSED)))
+    if seq_num > expected:
+        session.metrics.out_of_order_count += 1
+    acknowledge(server_socket, client_addr, session, seq_num, urgent=seq_num > expected)
+# asyncio engine, one event loop does the receiving and the retransmit timers
+class ChatServerProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.transport = None
+        self.retransmit_timer = None
+# the transport has the same sendto as a socket so the command code can use it as is
+    def connection_made(self, transport):
+        global server_socket
+        self.transport = transport
+        server_socket = transport
+        self.schedule_retransmit()
 
-            if seq_num < state["expected_sequence"]:
-                send_ack(server_socket, client_addr, seq_num)
-                continue
-            if seq_num not in state["out_of_order_buffer"]:
-                state["out_of_order_buffer"][seq_num] = (payload, current_time_millis())
-                if seq_num > state["expected_sequence"]:
-                    client_metrics[client_addr]["out_of_order_count"] += 1
-                send_ack(server_socket, client_addr, seq_num)
+    def datagram_received(self, data, addr):
+        handle_datagram(data, addr)
+        # something armed a timer that may be due before the one we are waiting on
+        if timer_wakeup.is_set():
+            timer_wakeup.clear()
+            self.retransmit_timer.cancel()
+            self.schedule_retransmit()
+
+    def error_received(self, exc):
+        print("[Server] Socket error:", exc)
 
-        deliver_ordered_messages(client_addr)
+    def connection_lost(self, exc):
+        if self.retransmit_timer is not None:
+            self.retransmit_timer.cancel()
+# retransmission runs on a loop timer instead of its own thread
+    def schedule_retransmit(self):
+        loop = asyncio.get_running_loop()
+        self.retransmit_timer = loop.call_later(retransmit_delay(), self.retransmit_tick)
+
+    def retransmit_tick(self):
+        service_timers(self.transport)
+        timer_wakeup.clear()
+        self.schedule_retransmit()
+# runs the asyncio engine until ctrl-c
+async def run_async_server(host, port, reuse_port=False, bound=None):
+    loop = asyncio.get_running_loop()
+    if room_bus is not None:
+        # bus events have to run on the loop like everything else
+        room_bus.handler = lambda from_worker, event: loop.call_soon_threadsafe(handle_bus_event, from_worker, event)
+    transport, _ = await loop.create_datagram_endpoint(ChatServerProtocol, local_addr=(host, port), reuse_port=reuse_port)
+    if bound is not None:
+        await loop.run_in_executor(None, bound.wait)
+    print(f"[Server] Listening on port {port} (asyncio)")
+    try:
+        await asyncio.Future()
+    finally:
+        transport.close()
+# command line options
+def parse_args():
+    parser = argparse.ArgumentParser(description="UDP chat server")
+    parser.add_argument("--engine", choices=["threaded", "asyncio"], default="threaded",
+                        help="threaded = blocking recv loop + retransmit thread, asyncio = one event loop")
+    parser.add_argument("--ack-every", type=int, default=ACK_EVERY,
+                        help="send a cumulative ack after this many packets")
+    parser.add_argument("--ack-delay-ms", type=float, default=ACK_DELAY * 1000,
+                        help="longest an ack is held back waiting for more packets")
+    parser.add_argument("--idle-timeout", type=float, default=idle_timeout,
+                        help="drop clients that sent nothing for this many seconds, 0 keeps them forever")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes sharing the port with SO_REUSEPORT, rooms span all of them")
+    parser.add_argument("--recv-threads", type=int, default=1,
+                        help="threads receiving on the socket with the threaded engine")
+    parser.add_argument("--host", default="0.0.0.0", help="address to listen on")
+    parser.add_argument("--port", type=int, default=5000, help="udp port to listen on")
+    parser.add_argument("--batch-delay-ms", type=float, default=0,
+                        help="coalesce packets to the same client for up to this long, 0 turns batching off")
+    parser.add_argument("--history-dir", default=None,
+                        help="keep room history in this directory, history is off without it")
+    parser.add_argument("--history-segment-kb", type=int, default=1024,
+                        help="size of one history segment file")
+    parser.add_argument("--history-max-mb", type=float, default=16,
+                        help="history kept per room before the oldest segment is dropped")
+    parser.add_argument("--history-max-age", type=float, default=86400,
+                        help="seconds a message stays in the history")
+    parser.add_argument("--history-max-open", type=int, default=128,
+                        help="history segments kept mapped at once, each one holds a file descriptor")
+    parser.add_argument("--history-on-join", type=int, default=history_on_join,
+                        help="messages replayed to a client when it joins a room, 0 for none")
+    parser.add_argument("--compression", choices=["on", "off"], default="on",
+                        help="compress payloads for clients that offer it at USERNAME")
+    parser.add_argument("--compress-threshold", type=int, default=COMPRESSION_THRESHOLD,
+                        help="payloads shorter than this many bytes are sent uncompressed")
+    parser.add_argument("--max-reassembly-mb", type=float, default=reassembly_budget.max_bytes / (1 << 20),
+                        help="most memory all clients together may hold in unfinished fragmented messages")
+    parser.add_argument("--capture", default=None,
+                        help="record every datagram read to this trace file for replay_capture.py, "
+                             "with --workers each worker writes FILE.workerN")
+    parser.add_argument("--stats-port", type=int, default=0,
+                        help="serve live counters in prometheus format on this tcp port at /metrics, 0 turns it off")
+    parser.add_argument("--stats-host", default="127.0.0.1", help="address the stats port listens on")
+    parser.add_argument("--stats-sample", type=int, default=0,
+                        help="time 1 in this many calls of every server stage, 0 keeps timing off")
+    return parser.parse_args()
 #main
 def main():
-    global server_socket
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    server_socket.bind(("0.0.0.0", 5000))
+    global ack_every, ack_delay, outbound_batcher, idle_timeout, history_on_join, compression_enabled, compress_threshold
+    args = parse_args()
+    compression_enabled = args.compression == "on"
+    compress_threshold = args.compress_threshold
+    idle_timeout = args.idle_timeout
+    history_on_join = max(0, args.history_on_join)
+    ack_every = max(1, args.ack_every)
+    ack_delay = args.ack_delay_ms / 1000
+    reassembly_budget.max_bytes = int(args.max_reassembly_mb * (1 << 20))
+    if args.batch_delay_ms > 0:
+        outbound_batcher = PacketBatcher(args.batch_delay_ms / 1000, max_packet)
 
-    print("[Server] Listening on port 5000")
+    if args.workers > 1:
+        run_workers(args)
+    else:
+        run_server(args)
+# runs one server, the whole thing in single process mode or one shard with --workers
+# bound waits until every worker has bound the port, the kernel rehashes clients whenever a socket joins the group
+def run_server(args, reuse_port=False, bound=None):
+    global server_socket, room_history, capture
+    if args.history_dir:
+        # every worker keeps its own log, they all see every message so any of them can replay a room
+        directory = os.path.join(args.history_dir, f"worker{worker_id}") if room_bus else args.history_dir
+        room_history = RoomHistory(directory, args.history_segment_kb * 1024, int(args.history_max_mb * (1 << 20)),
+                                   args.history_max_age, args.history_max_open)
+    if args.capture:
+        capture = CaptureWriter(f"{args.capture}.worker{worker_id}" if room_bus else args.capture)
+    stats.set_sampling(args.stats_sample)
+    stats_server = None
+    if args.stats_port:
+        # with --workers every worker serves its own numbers on the next port up
+        stats_server = StatsServer(args.stats_host, args.stats_port + worker_id, stats, stats_gauges)
+        stats_server.start()
+    try:
+        if args.engine == "asyncio":
+            asyncio.run(run_async_server(args.host, args.port, reuse_port, bound))
+        else:
+            server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if reuse_port:
+                server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            server_socket.bind((args.host, args.port))
+            if bound is not None:
+                bound.wait()
 
-    threading.Thread(target=retransmit_unacked_packets, args=(server_socket,), daemon=True).start()
+            print(f"[Server] Listening on port {args.port}" + (f" (worker {worker_id})" if room_bus else ""))
 
-    try:
-        server_loop()
+            threading.Thread(target=retransmit_unacked_packets, args=(server_socket,), daemon=True).start()
+            # extra threads share the socket, packets from one client may land on any of them
+            for _ in range(args.recv_threads - 1):
+                threading.Thread(target=server_loop, daemon=True).start()
+            server_loop()
     except KeyboardInterrupt:
         print("\n[Server] Shutting down")
-        for addr in list(client_metrics.keys()):
+        for addr in list(client_sessions.keys()):
             print_client_metrics(addr)
         print("[Server] Server stopped")
+    finally:
+        if stats_server is not None:
+            stats_server.close()
+        if room_history is not None:
+            room_history.close()
+        if capture is not None:
+            capture.close()
+            print(f"[Server] Captured {capture.written} datagrams to {capture.path}, {capture.dropped} dropped")
+# values read on every stats scrape, name -> (help, value)
+def stats_gauges():
+    sessions = list(client_sessions.values())
+    return {
+        "clients_connected": ("client sessions open now", len(sessions)),
+        "max_clients_connected": ("most client sessions open at once", max_clients_connected),
+        "rooms": ("rooms with members on this worker", len(room_members)),
+        "packets_in_flight": ("packets sent and waiting for an ack", len(retransmit_timers)),
+        "outbound_queued": ("packets waiting for room in a send window", sum(s.outbound_packets for s in sessions)),
+        "delayed_acks": ("acks held back waiting for more packets", len(ack_timers)),
+        "reassembly_bytes": ("bytes held in unfinished fragmented messages", reassembly_budget.used),
+        "worker": ("worker number with --workers, 0 otherwise", worker_id),
+        "capture_dropped": ("datagrams left out of the --capture trace because the writer fell behind",
+                            capture.dropped if capture is not None else 0),
+    }
+# one process per worker, all bound to the same port with SO_REUSEPORT so the kernel keeps sending a
+# client address to the same worker, the parent only starts them and passes ctrl-c on
+def run_workers(args):
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise SystemExit("--workers needs SO_REUSEPORT, which this platform does not have")
+    directory = tempfile.mkdtemp(prefix="chat_bus_")
+    bound = multiprocessing.Barrier(args.workers)
+    workers = [multiprocessing.Process(target=run_worker, args=(shard, args, directory, bound))
+               for shard in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # ctrl-c in a terminal already reached the workers, a signal sent to the parent alone did not
+        for worker in workers:
+            worker.join(0.5)
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGINT)
+        for worker in workers:
+            worker.join(5)
+            if worker.is_alive():
+                worker.terminate()
+    finally:
+        for name in os.listdir(directory):
+            os.unlink(os.path.join(directory, name))
+        os.rmdir(directory)
+
+def run_worker(shard, args, directory, bound):
+    global room_bus, worker_id
+    worker_id = shard
+    room_bus = RoomBus(shard, args.workers, directory, handle_bus_event)
+    try:
+        room_bus.start()
+    except KeyboardInterrupt:
+        return
+    try:
+        run_server(args, reuse_port=True, bound=bound)
+    finally:
+        room_bus.close()
 if __name__ == "__main__":
     main()
@@ -0,0 +1,72 @@
+import threading
+import time
+from congestion import RttEstimator, CongestionWindow
+from chat_metrics import LatencyHistogram
+from fragmentation import Reassembler
+from seq_window import ReceiveWindow, SendWindow
+
+# everything the server keeps for one client address, slots keep it to one small object per client
+# lock covers the windows, buffers and metrics, deliver_lock keeps the clients commands running one at a time in order
+class ClientSession:
+    __slots__ = ("lock", "deliver_lock", "receive_window", "send_window", "legacy_text", "acks_pending",
+                 "outbound_queue", "outbound_sent", "outbound_packets", "undelivered", "reassembler", "reassembly_budget",
+                 "rtt", "cwnd", "last_seen", "compressor", "metrics")
+
+    def __init__(self, initial_rto, max_window, now=None, reassembly_budget=None):
+        self.lock = threading.Lock()
+        self.deliver_lock = threading.Lock()
+        # (message, recv_time, fragment flag) for packets that came in ahead of a gap, expected is the next one to run
+        self.receive_window = ReceiveWindow(max_window)
+        # (payload, flags, sent_time, retransmissions) for everything sent and not acked yet
+        self.send_window = SendWindow(max_window)
+        self.legacy_text = False
+        self.acks_pending = 0
+        # a deque of messages waiting for room in the send window, each a list of (payload, flags) parts, None while
+        # nothing waits, outbound_sent parts of the first one are already in the window, outbound_packets parts are still waiting
+        self.outbound_queue = None
+        self.outbound_sent = 0
+        self.outbound_packets = 0
+        # messages dropped because the queue was full that the client has not been told about yet
+        self.undelivered = 0
+        # reassembly_budget is the ReassemblyBudget shared by every session of the server, the Reassembler is only
+        # made by get_reassembler() once the client sends a fragment, most clients never do
+        self.reassembler = None
+        self.reassembly_budget = reassembly_budget
+        self.rtt = RttEstimator(initial_rto)
+        self.cwnd = CongestionWindow(max_window)
+        # time.time() of the last datagram from the client, idle sessions are dropped by the expiry sweep
+        self.last_seen = time.time() if now is None else now
+        # the PayloadCompressor agreed on at USERNAME, None sends everything as plain text
+        self.compressor = None
+        self.metrics = ClientMetrics()
+# the sessions Reassembler, made on the first fragment
+    def get_reassembler(self):
+        if self.reassembler is None:
+            self.reassembler = Reassembler(budget=self.reassembly_budget)
+        return self.reassembler
+
+# per client counters for the metrics printout
+class ClientMetrics:
+    __slots__ = ("retransmissions_count", "out_of_order_count", "latency_histogram", "messages_received",
+                 "bytes_received", "start_timestamp", "end_timestamp", "total_packets_received", "acks_sent",
+                 "outbound_dropped", "rejected_packets")
+
+    def __init__(self):
+        self.retransmissions_count = 0
+        self.out_of_order_count = 0
+        # made on the first latency recorded, see record_latency
+        self.latency_histogram = None
+        self.messages_received = 0
+        self.bytes_received = 0
+        self.start_timestamp = None
+        self.end_timestamp = None
+        self.total_packets_received = 0
+        self.acks_sent = 0
+        self.outbound_dropped = 0
+        # data packets that were too far ahead of the receive window and got dropped
+        self.rejected_packets = 0
+# adds one latency sample, the histogram is made on the first one
+    def record_latency(self, latency):
+        if self.latency_histogram is None:
+            self.latency_histogram = LatencyHistogram()
+        self.latency_histogram.record(latency)
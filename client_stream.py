@@ -0,0 +1,280 @@
+import time
+from collections import deque
+from retransmit_scheduler import RetransmitScheduler
+from fragmentation import Reassembler, split_payload
+from chat_protocol import (create_packet, iter_packets, create_ack_packet, parse_sack, sacked_sequences,
+                           FLAG_ACK, FLAG_FRAG, FLAG_COMPRESSED, FLAG_RESET, FLAG_LEGACY_TEXT, SEQ_MASK, ACK_EVERY,
+                           ACK_DELAY)
+from chat_compression import PayloadCompressor, offer_token
+from congestion import RttEstimator, CongestionWindow
+from seq_window import ReceiveWindow, SendWindow, unwrap_seq
+
+# the client side of the protocol with no sockets, threads or event loop: sequencing, acks and sacks,
+# retransmits, the congestion window, fragments, compression and the reset handshake
+# AsyncChatClient and the threaded ChatClient both drive one of these, every call takes the current time and
+# returns the packets to put on the wire, receive also returns the lines the server sent, one per line of text
+# when the server answers with a reset (our session expired or it restarted) the stream logs in again, joins
+# its rooms again and resends every message the server had not run yet, before anything queued after it
+max_packet = 4096
+window_size = 100
+ack_timeout = 1.0
+# an idle client sends an ack this often so the server does not drop its session (the server waits 60s by default)
+keepalive_interval = 15.0
+# what the server says in its welcome when it picked one of the dictionaries we offered
+compression_marker = " (compression "
+
+class ClientStream:
+    def __init__(self, offered=(), max_packet=max_packet, window_size=window_size, ack_timeout=ack_timeout,
+                 keepalive_interval=keepalive_interval):
+        self.max_packet = max_packet
+        self.window_size = window_size
+        self.keepalive_interval = keepalive_interval
+        # dictionaries offered at login, and the compressor for the one the server picked
+        self.offered = list(offered)
+        self.compressor = None
+        self.rtt = RttEstimator(ack_timeout)
+        self.cwnd = CongestionWindow(window_size)
+        self.message_ids = 0
+        self.retransmissions = 0
+        self.resets = 0
+        # goes up on every reset, whoever waits for a message from before it to go out can stop waiting
+        self.epoch = 0
+        # the USERNAME line and the rooms joined, sent again to set up a new session after a reset
+        self.login_command = None
+        self.rooms = {}
+        # set once the server answered anything in this session, a reset before that is for an older session
+        self.established = False
+        self.last_transmit = time.time()
+        self.start_streams()
+# both directions from sequence 0, for a new stream and after a reset
+    def start_streams(self):
+        # (payload, flags, sent_time, retransmissions) for every packet the server has not acked yet
+        self.send_window = SendWindow(self.window_size)
+        self.retransmit_timers = RetransmitScheduler()
+        # (payload, flags, unacked entry or None) packets waiting for room in the window,
+        # the entry goes with the last packet of a message
+        self.pending = deque()
+        # [seq of the last packet or None until it is sent, message] for every message the server has not run yet,
+        # oldest first, and everything below acked_below has been run
+        self.unacked = deque()
+        self.acked_below = 0
+        # the servers stream to us, buffered until it can be handed out in order
+        self.receive_window = ReceiveWindow(self.window_size)
+        self.reassembler = Reassembler()
+        self.acks_pending = 0
+        self.ack_deadline = None
+# the USERNAME line, with the compression offer when there is one
+    def login_line(self, username):
+        if self.offered:
+            return f"USERNAME {username} {offer_token(self.offered)}"
+        return f"USERNAME {username}"
+# puts a message behind everything queued so far, returns its unacked entry, entry[0] is set once all of it is sent
+    def queue(self, message):
+        self.remember(message)
+        entry = [None, message]
+        self.unacked.append(entry)
+        parts = self.encode(message)
+        for part, flags in parts[:-1]:
+            self.pending.append((part, flags, None))
+        part, flags = parts[-1]
+        self.pending.append((part, flags, entry))
+        return entry
+# the (payload, flags) packets a message goes out as, compressed once the server agreed to it
+    def encode(self, message):
+        payload = message.encode() if isinstance(message, str) else bytes(message)
+        flags = 0
+        if self.compressor is not None:
+            data = self.compressor.compress(payload)
+            if data is not None:
+                payload = data
+                flags = FLAG_COMPRESSED
+        fragments = split_payload(payload, self.message_ids & SEQ_MASK, self.max_packet)
+        if not fragments:
+            return [(payload, flags)]
+        self.message_ids += 1
+        return [(fragment, FLAG_FRAG | flags) for fragment in fragments]
+# keeps what a new session needs to be set up like this one
+    def remember(self, message):
+        if not isinstance(message, str):
+            return
+        command, _, rest = message.partition(" ")
+        command = command.upper()
+        room_name = rest.split(" ", 1)[0]
+        if command == "USERNAME":
+            self.login_command = message
+        elif command == "JOIN" and room_name:
+            self.rooms[room_name] = True
+        elif command == "LEAVE":
+            self.rooms.pop(room_name, None)
+# the window is the smaller of window_size and cwnd, counted from the oldest unacked packet
+    def window_limit(self):
+        return self.send_window.base + min(self.window_size, self.cwnd.window())
+# true when a new message would go straight out, queued packets go first so nothing new gets ahead of them
+    def window_has_room(self):
+        return not self.pending and self.send_window.next_seq < self.window_limit()
+# true once everything queued has been sent and acked
+    def drained(self):
+        return not self.pending and not len(self.send_window)
+# moves queued packets into the window while it has room, returns the packets to send
+    def pump(self, now):
+        packets = []
+        send_window = self.send_window
+        limit = self.window_limit()
+        while self.pending and send_window.next_seq < limit:
+            payload, flags, entry = self.pending.popleft()
+            seq_num = send_window.add((payload, flags, now, 0))
+            self.retransmit_timers.schedule(seq_num, now + self.rtt.rto)
+            packets.append(create_packet(seq_num, 0, payload, flags))
+            if entry is not None:
+                entry[0] = seq_num
+        if packets:
+            self.last_transmit = now
+        return packets
+# one datagram from the server, returns (packets to send, lines to hand out)
+    def receive(self, data, now):
+        packets = []
+        lines = []
+        for seq_num, ack_num, flags, payload in iter_packets(data):
+            if flags & FLAG_RESET:
+                # only once per session, the resets for packets sent before it are ignored until the server answers
+                if self.established:
+                    packets += self.reset_session(now)
+                continue
+            self.established = True
+            if flags & FLAG_ACK:
+                packets += self.handle_ack(ack_num, parse_sack(flags, payload), now)
+            elif flags & FLAG_LEGACY_TEXT:
+                # old servers dont sequence what they send us
+                self.deliver(payload.decode("utf-8", "replace"), lines)
+            else:
+                packets += self.receive_data(seq_num, flags, payload, now, lines)
+        return packets, lines
+# one ack confirms everything below next_expected plus whatever the sack bitmap lists
+    def handle_ack(self, next_expected, sack_bits, now):
+        # the wire only has the low 32 bits, the ack is somewhere around the oldest unacked packet
+        next_expected = unwrap_seq(next_expected, self.send_window.base)
+        newly_acked = 0
+        for seq_num, entry in self.send_window.release_below(next_expected):
+            newly_acked += self.ack_sent_packet(seq_num, entry, now)
+        for seq_num in sacked_sequences(next_expected, sack_bits, self.send_window.next_seq):
+            entry = self.send_window.remove(seq_num)
+            if entry is not None:
+                newly_acked += self.ack_sent_packet(seq_num, entry, now)
+        if next_expected > self.acked_below:
+            self.acked_below = min(next_expected, self.send_window.next_seq)
+            unacked = self.unacked
+            while unacked and unacked[0][0] is not None and unacked[0][0] < self.acked_below:
+                unacked.popleft()
+        if not newly_acked:
+            return []
+        self.cwnd.on_ack(newly_acked)
+        return self.pump(now)
+# stops the timer for one packet that left the window and takes an rtt sample if it was only sent once
+    def ack_sent_packet(self, seq_num, entry, now):
+        self.retransmit_timers.cancel(seq_num)
+        message, flags, last_sent_time, retrans_count = entry
+        if retrans_count == 0:
+            self.rtt.sample(now - last_sent_time)
+        return 1
+# puts a packet from the server in order and acks it, in order packets are acked every ACK_EVERY or after ACK_DELAY
+# everything that is now in order goes to lines
+    def receive_data(self, seq_num, flags, payload, now, lines):
+        receive_window = self.receive_window
+        seq_num = unwrap_seq(seq_num, receive_window.expected)
+        in_order = seq_num == receive_window.expected and not receive_window.buffered
+        if not receive_window.offer(seq_num, (payload, flags)):
+            # a duplicate means our ack got lost, tell the server again right away
+            # anything past the window is dropped so the server cannot make us buffer more than one window
+            return [self.cumulative_ack(now)]
+        while True:
+            entry = receive_window.pop()
+            if entry is None:
+                break
+            message, flags = entry
+            if flags & FLAG_FRAG:
+                # handed out once the last fragment is in
+                message = self.reassembler.add(message)
+                if message is None:
+                    continue
+            if flags & FLAG_COMPRESSED:
+                if self.compressor is None:
+                    continue
+                message = self.compressor.decompress(message, self.reassembler.max_message_size)
+                if message is None:
+                    continue
+            self.deliver(message.decode("utf-8", "replace"), lines)
+        self.acks_pending += 1
+        if not in_order or self.acks_pending >= ACK_EVERY:
+            return [self.cumulative_ack(now)]
+        if self.ack_deadline is None:
+            self.ack_deadline = now + ACK_DELAY
+        return []
+# one ack for everything received so far plus a sack bitmap of whats past the gap
+    def cumulative_ack(self, now):
+        next_expected = self.receive_window.expected
+        self.acks_pending = 0
+        self.ack_deadline = None
+        self.last_transmit = now
+        return create_ack_packet(next_expected, self.receive_window.sack_bits(next_expected))
+# history replies pack several lines in one message, each line is handed out on its own
+    def deliver(self, text, lines):
+        for line in text.split("\n"):
+            if self.offered and line.startswith("[Server] Welcome "):
+                self.agree_compression(line)
+            lines.append(line)
+# the welcome names the dictionary the server picked, from here on both sides may compress
+    def agree_compression(self, line):
+        _, found, rest = line.partition(compression_marker)
+        name = rest.rstrip(")")
+        if found and name in self.offered:
+            self.compressor = PayloadCompressor(name)
+# the server has no session for us: start both streams over from 0, queue the login, the joins and every
+# message it had not run yet ahead of anything new, returns what fits in the window
+    def reset_session(self, now):
+        self.resets += 1
+        self.epoch += 1
+        self.established = False
+        pending = [message for _, message in self.unacked]
+        self.start_streams()
+        # the new session agrees on compression again in its welcome
+        self.compressor = None
+        setup = [self.login_command] if self.login_command else []
+        setup += [f"JOIN {room_name}" for room_name in self.rooms]
+        for message in setup + [message for message in pending if not self.is_setup(message)]:
+            self.queue(message)
+        return self.pump(now)
+
+    def is_setup(self, message):
+        command = message.partition(" ")[0].upper() if isinstance(message, str) else ""
+        return command in ("USERNAME", "JOIN")
+# everything that runs on a deadline: the delayed ack, the keepalive and retransmits, returns the packets to send
+    def on_timer(self, now):
+        packets = []
+        if self.ack_deadline is not None and now >= self.ack_deadline:
+            packets.append(self.cumulative_ack(now))
+        elif now - self.last_transmit >= self.keepalive_interval:
+            # nothing went out for a while, an ack doubles as a keepalive
+            packets.append(self.cumulative_ack(now))
+        for seq_num in self.retransmit_timers.pop_expired(now):
+            entry = self.send_window.get(seq_num)
+            if entry is None:
+                continue
+            message, flags, last_sent_time, retrans_count = entry
+            self.rtt.timeout(last_sent_time, now)
+            self.cwnd.on_loss(seq_num, self.send_window.next_seq)
+            packets.append(create_packet(seq_num, 0, message, flags))
+            self.send_window.update(seq_num, (message, flags, now, retrans_count + 1))
+            self.retransmit_timers.schedule(seq_num, now + self.rtt.rto)
+            self.retransmissions += 1
+        if packets:
+            self.last_transmit = now
+        return packets
+# when on_timer next has something to do
+    def next_deadline(self):
+        deadline = self.last_transmit + self.keepalive_interval
+        if self.ack_deadline is not None:
+            deadline = min(deadline, self.ack_deadline)
+        next_retransmit = self.retransmit_timers.next_deadline()
+        if next_retransmit is not None:
+            deadline = min(deadline, next_retransmit)
+        return deadline
@@ -0,0 +1,53 @@
+MIN_RTO = 0.05
+MAX_RTO = 10.0
+INITIAL_CWND = 4.0
+MIN_CWND = 2.0
+
+# per peer round trip estimate (srtt/rttvar like tcp), the rto doubles on every timeout until a clean sample comes back
+class RttEstimator:
+    def __init__(self, initial_rto=1.0):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.backoff_time = 0.0
+# only call this for packets that were never retransmitted, otherwise we dont know which copy got acked
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(MAX_RTO, max(MIN_RTO, self.srtt + 4 * self.rttvar))
+# exponential backoff, only packets sent after the last backoff count so a window of timeouts doubles it once
+    def timeout(self, sent_time, now):
+        if sent_time < self.backoff_time:
+            return
+        self.rto = min(MAX_RTO, self.rto * 2)
+        self.backoff_time = now
+
+# aimd congestion window: slow start up to ssthresh, then +1 packet per window, halved on loss
+class CongestionWindow:
+    def __init__(self, max_window):
+        self.max_window = max_window
+        self.cwnd = min(INITIAL_CWND, max_window)
+        self.ssthresh = float(max_window)
+        self.recover_seq = 0
+# acked is how many packets one ack released
+    def on_ack(self, acked=1):
+        for _ in range(acked):
+            if self.cwnd < self.ssthresh:
+                self.cwnd += 1
+            else:
+                self.cwnd += 1 / self.cwnd
+        self.cwnd = min(self.cwnd, float(self.max_window))
+# only cut once per window of data, next_seq is the next sequence number the sender will use
+    def on_loss(self, seq_num, next_seq):
+        if seq_num < self.recover_seq:
+            return
+        self.ssthresh = max(self.cwnd / 2, MIN_CWND)
+        self.cwnd = self.ssthresh
+        self.recover_seq = next_seq
+# how many packets may be in flight right now
+    def window(self):
+        return max(1, int(self.cwnd))
@@ -0,0 +1,78 @@
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+# records every datagram the server reads to a trace file so a bad hour can be replayed offline with replay_capture.py
+# the file is a magic string then one record per datagram: receive time + ipv4 address + port + length, then the bytes
+# the receive path only appends to a deque, a background thread packs the records and writes them in big chunks,
+# if the disk falls behind by more than max_pending bytes datagrams are counted as dropped instead of piling up
+MAGIC = b"CHATCAP1"
+RECORD = struct.Struct("!d4sHH")
+
+class CaptureWriter:
+    def __init__(self, path, flush_interval=0.2, max_pending=64 << 20):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.file = open(path, "wb", buffering=1 << 20)
+        self.file.write(MAGIC)
+        # (time, address, bytes) waiting for the writer thread, deque appends and pops are safe across threads
+        self.pending = deque()
+        # bytes queued by the receive path and bytes written by the writer thread, each only changed by its own side
+        self.queued_bytes = 0
+        self.written_bytes = 0
+        self.written = 0
+        self.dropped = 0
+        self.closing = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+# called from the receive path, the bound is only rough when several threads receive
+    def record(self, packet, addr):
+        if self.queued_bytes - self.written_bytes > self.max_pending:
+            self.dropped += 1
+            return
+        self.pending.append((time.time(), addr, bytes(packet)))
+        self.queued_bytes += len(packet)
+
+    def run(self):
+        while not self.closing.wait(self.flush_interval):
+            self.write_pending()
+# packs and writes everything queued so far, only the writer thread and close call this
+    def write_pending(self):
+        pending = self.pending
+        chunk = []
+        size = 0
+        while pending:
+            timestamp, addr, data = pending.popleft()
+            chunk.append(RECORD.pack(timestamp, socket.inet_aton(addr[0]), addr[1], len(data)))
+            chunk.append(data)
+            size += len(data)
+        if not chunk:
+            return
+        self.file.write(b"".join(chunk))
+        self.file.flush()
+        self.written_bytes += size
+        self.written += len(chunk) // 2
+
+    def close(self):
+        self.closing.set()
+        self.thread.join()
+        self.write_pending()
+        self.file.close()
+
+# yields (time, (ip, port), bytes) for every datagram in a trace, a record cut short by a crash ends it
+def read_capture(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a capture file")
+    offset = len(MAGIC)
+    while offset + RECORD.size <= len(data):
+        timestamp, address, port, length = RECORD.unpack_from(data, offset)
+        start = offset + RECORD.size
+        if start + length > len(data):
+            break
+        yield timestamp, (socket.inet_ntoa(address), port), data[start:start + length]
+        offset = start + length
@@ -0,0 +1,123 @@
+import struct
+import threading
+import time
+from chat_protocol import HEADER_SIZE
+
+# payloads bigger than one datagram are split into fragments, each one is its own packet in the
+# reliable stream (so only a lost fragment gets resent) and carries FLAG_FRAG plus this header:
+# message id, byte offset, total length, fragment index, fragment count
+FRAGMENT = struct.Struct("!IIIHH")
+MAX_MESSAGE_SIZE = 1 << 20
+MAX_REASSEMBLY_BYTES = 4 << 20
+MAX_TOTAL_REASSEMBLY_BYTES = 64 << 20
+REASSEMBLY_TIMEOUT = 30.0
+
+# the most payload bytes a fragment can carry when the packet has to fit in max_datagram,
+# leaves room for a batch header so fragments can still be batched
+def fragment_size(max_datagram):
+    return max_datagram - 2 * HEADER_SIZE - FRAGMENT.size
+# splits payload into fragment payloads, returns [] when it fits in one packet
+def split_payload(payload, message_id, max_datagram):
+    chunk = fragment_size(max_datagram)
+    if len(payload) + HEADER_SIZE * 2 <= max_datagram:
+        return []
+    count = (len(payload) + chunk - 1) // chunk
+    view = memoryview(payload)
+    fragments = []
+    for index in range(count):
+        offset = index * chunk
+        header = FRAGMENT.pack(message_id, offset, len(payload), index, count)
+        fragments.append(header + view[offset:offset + chunk])
+    return fragments
+
+# bytes held for reassembly by every peer of a server together, so many addresses cant each fill their own cap
+# reassemblers of different clients run on different threads, the lock only covers the count
+class ReassemblyBudget:
+    def __init__(self, max_bytes=MAX_TOTAL_REASSEMBLY_BYTES):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.lock = threading.Lock()
+# takes size bytes out of the budget, False when that would go over it
+    def reserve(self, size):
+        with self.lock:
+            if self.used + size > self.max_bytes:
+                return False
+            self.used += size
+            return True
+
+    def release(self, size):
+        with self.lock:
+            self.used -= size
+
+# per peer reassembly, fragments are kept as they arrive and joined once the last one is in, so a message only
+# holds the bytes that actually came and not the total its first fragment claims
+# max_buffered caps one peer, the optional budget caps all peers together, a message that would go over either is dropped
+class Reassembler:
+    def __init__(self, max_message_size=MAX_MESSAGE_SIZE, max_buffered=MAX_REASSEMBLY_BYTES,
+                 timeout=REASSEMBLY_TIMEOUT, budget=None):
+        self.max_message_size = max_message_size
+        self.max_buffered = max_buffered
+        self.timeout = timeout
+        self.budget = budget
+        # message id -> [fragment index -> bytes, fragment count, total length, bytes held, started]
+        self.messages = {}
+        self.buffered_bytes = 0
+        self.dropped = 0
+# adds one fragment, returns the whole message as bytes once the last piece is in, otherwise None
+    def add(self, fragment, now=None):
+        if len(fragment) < FRAGMENT.size:
+            self.dropped += 1
+            return None
+        now = time.time() if now is None else now
+        message_id, offset, total, index, count = FRAGMENT.unpack_from(fragment)
+        chunk = fragment[FRAGMENT.size:]
+        size = len(chunk)
+        if total > self.max_message_size or index >= count or offset + size > total:
+            self.dropped += 1
+            return None
+
+        entry = self.messages.get(message_id)
+        if entry is None:
+            self.expire(now)
+            entry = self.messages[message_id] = [{}, count, total, 0, now]
+        chunks = entry[0]
+        if entry[1] != count or entry[2] != total or entry[3] + size > total:
+            self.drop(message_id)
+            return None
+        if index in chunks:
+            return None
+        if self.buffered_bytes + size > self.max_buffered or (self.budget is not None and not self.budget.reserve(size)):
+            self.drop(message_id)
+            return None
+        chunks[index] = chunk
+        entry[3] += size
+        self.buffered_bytes += size
+        if len(chunks) < count:
+            return None
+        self.forget(message_id)
+        if entry[3] != total:
+            self.dropped += 1
+            return None
+        return b"".join([chunks[i] for i in range(count)])
+# the time the oldest unfinished message started, None when nothing is waiting
+    def oldest(self):
+        return min((entry[4] for entry in self.messages.values()), default=None)
+# drops messages that have been waiting longer than the timeout
+    def expire(self, now):
+        for message_id in [message_id for message_id, entry in self.messages.items() if now - entry[4] > self.timeout]:
+            self.drop(message_id)
+# drops everything still waiting, for a peer that is going away
+    def clear(self):
+        for message_id in list(self.messages):
+            self.drop(message_id)
+
+    def drop(self, message_id):
+        if message_id in self.messages:
+            self.forget(message_id)
+            self.dropped += 1
+# takes a message out and gives its bytes back to the caps
+    def forget(self, message_id):
+        held = self.messages.pop(message_id)[3]
+        self.buffered_bytes -= held
+        if self.budget is not None and held:
+            self.budget.release(held)
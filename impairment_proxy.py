@@ -0,0 +1,231 @@
+import argparse
+import heapq
+import random
+import selectors
+import socket
+import threading
+import time
+
+# udp proxy that sits between clients and the server and impairs the traffic on purpose:
+# loss, delay + jitter, reordering, duplication and a bandwidth cap, each direction on its own
+# every client gets its own upstream socket so the server still sees one address per client,
+# and every flow and direction draws from its own rng seeded from --seed so a run can be repeated exactly
+# usage: python impairment_proxy.py --listen 5001 --server 127.0.0.1:5000 --profile lossy --seed 1
+max_datagram = 65535
+# flows with no traffic for this long are closed
+flow_idle_timeout = 120.0
+
+# loss/reorder/duplicate are probabilities, delay and jitter are ms, rate_kbps 0 means no cap
+profiles = {
+    "clean": {},
+    "lan": {"delay_ms": 1, "jitter_ms": 0.5},
+    # the two levels the old in-process packet_loss flag picked between
+    "small_loss": {"loss": 0.05},
+    "big_loss": {"loss": 0.10},
+    "lossy": {"loss": 0.20, "delay_ms": 5, "jitter_ms": 2},
+    "wifi": {"loss": 0.02, "delay_ms": 8, "jitter_ms": 6, "reorder": 0.02, "duplicate": 0.01},
+    "reorder": {"delay_ms": 10, "reorder": 0.25},
+    "duplicate": {"duplicate": 0.20},
+    "dsl": {"delay_ms": 20, "jitter_ms": 2, "rate_kbps": 1000},
+    "satellite": {"loss": 0.01, "delay_ms": 300, "jitter_ms": 20, "rate_kbps": 5000},
+    "terrible": {"loss": 0.30, "delay_ms": 50, "jitter_ms": 40, "reorder": 0.10, "duplicate": 0.05, "rate_kbps": 500},
+}
+impairment_fields = ("loss", "delay_ms", "jitter_ms", "reorder", "duplicate", "rate_kbps")
+
+# the profile settings with any explicit overrides on top
+def build_profile(name, **overrides):
+    if name not in profiles:
+        raise ValueError(f"unknown profile {name!r}, pick one of {', '.join(profiles)}")
+    profile = dict.fromkeys(impairment_fields, 0)
+    profile.update(profiles[name])
+    profile.update({field: value for field, value in overrides.items() if value is not None})
+    return profile
+
+# one direction of the link (client -> server or server -> client)
+class Link:
+    def __init__(self, profile, seed, direction, max_queue_delay=1.0):
+        self.profile = profile
+        self.seed = seed
+        self.direction = direction
+        # with a bandwidth cap packets queue behind each other, anything that would wait longer than this is dropped
+        self.max_queue_delay = max_queue_delay
+        self.rngs = {}
+        self.next_free = 0.0
+        self.stats = {"packets": 0, "dropped": 0, "duplicated": 0, "reordered": 0, "queue_drops": 0}
+
+    def rng(self, flow):
+        rng = self.rngs.get(flow)
+        if rng is None:
+            rng = self.rngs[flow] = random.Random(f"{self.seed}:{self.direction}:{flow}")
+        return rng
+# the times this packet should come out the other end, [] when it is lost
+    def delivery_times(self, now, size, flow):
+        profile = self.profile
+        rng = self.rng(flow)
+        self.stats["packets"] += 1
+        # every packet always makes the same number of draws so one decision never shifts the next ones
+        lost, duplicated, reordered = rng.random(), rng.random(), rng.random()
+        jitters = rng.uniform(-1, 1), rng.uniform(-1, 1)
+        if lost < profile["loss"]:
+            self.stats["dropped"] += 1
+            return []
+
+        # with a cap the packet is out once it has been serialized behind the ones before it
+        arrival = now
+        if profile["rate_kbps"]:
+            start = max(now, self.next_free)
+            if start - now > self.max_queue_delay:
+                self.stats["queue_drops"] += 1
+                return []
+            self.next_free = arrival = start + size * 8 / (profile["rate_kbps"] * 1000)
+        copies = 2 if duplicated < profile["duplicate"] else 1
+        if copies == 2:
+            self.stats["duplicated"] += 1
+        times = []
+        for copy in range(copies):
+            delay = max(0.0, profile["delay_ms"] + jitters[copy] * profile["jitter_ms"]) / 1000
+            if copy == 0 and reordered < profile["reorder"]:
+                # held back long enough for the packets behind it to overtake
+                delay += max(profile["delay_ms"], 2 * profile["jitter_ms"], 10) / 1000
+                self.stats["reordered"] += 1
+            times.append(arrival + delay)
+        return times
+
+class ImpairmentProxy:
+    def __init__(self, listen_addr, server_addr, profile, seed=0):
+        self.server_addr = server_addr
+        self.listen_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.listen_socket.bind(listen_addr)
+        self.listen_addr = self.listen_socket.getsockname()
+        self.uplink = Link(profile, seed, "up")
+        self.downlink = Link(profile, seed, "down")
+        # client address -> [upstream socket, flow number, last seen]
+        self.flows = {}
+        # upstream socket -> client address
+        self.upstream_clients = {}
+        self.flow_count = 0
+        # (due time, tie breaker, socket, data, destination)
+        self.pending = []
+        self.sent = 0
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listen_socket, selectors.EVENT_READ)
+        self.running = False
+        self.thread = None
+# gets or opens the upstream socket for a client
+    def flow(self, client_addr, now):
+        entry = self.flows.get(client_addr)
+        if entry is None:
+            upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            upstream.bind((self.listen_addr[0], 0))
+            self.selector.register(upstream, selectors.EVENT_READ)
+            entry = self.flows[client_addr] = [upstream, self.flow_count, now]
+            self.upstream_clients[upstream] = client_addr
+            # flow numbers are never reused so a later client does not replay an old rng
+            self.flow_count += 1
+        entry[2] = now
+        return entry
+
+    def schedule(self, link, flow_number, now, sock, data, destination):
+        for due in link.delivery_times(now, len(data), flow_number):
+            self.sent += 1
+            heapq.heappush(self.pending, (due, self.sent, sock, data, destination))
+
+    def receive(self, sock, now):
+        try:
+            data, addr = sock.recvfrom(max_datagram)
+        except OSError:
+            return
+        if sock is self.listen_socket:
+            upstream, flow_number, _ = self.flow(addr, now)
+            self.schedule(self.uplink, flow_number, now, upstream, data, self.server_addr)
+        else:
+            client_addr = self.upstream_clients.get(sock)
+            if client_addr is None:
+                return
+            flow_number = self.flows[client_addr][1]
+            self.flows[client_addr][2] = now
+            self.schedule(self.downlink, flow_number, now, self.listen_socket, data, client_addr)
+
+    def send_due(self, now):
+        while self.pending and self.pending[0][0] <= now:
+            _, _, sock, data, destination = heapq.heappop(self.pending)
+            try:
+                sock.sendto(data, destination)
+            except OSError:
+                pass
+
+    def close_idle_flows(self, now):
+        for client_addr in [addr for addr, entry in self.flows.items() if now - entry[2] > flow_idle_timeout]:
+            upstream = self.flows.pop(client_addr)[0]
+            self.selector.unregister(upstream)
+            del self.upstream_clients[upstream]
+            upstream.close()
+
+    def run(self):
+        self.running = True
+        last_sweep = time.time()
+        while self.running:
+            now = time.time()
+            timeout = 0.1 if not self.pending else min(0.1, max(0.0, self.pending[0][0] - now))
+            for key, _ in self.selector.select(timeout):
+                self.receive(key.fileobj, time.time())
+            now = time.time()
+            self.send_due(now)
+            if now - last_sweep > flow_idle_timeout / 4:
+                self.close_idle_flows(now)
+                last_sweep = now
+# runs the proxy on a background thread, for scripts that start it in process
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        for entry in self.flows.values():
+            entry[0].close()
+        self.listen_socket.close()
+        self.selector.close()
+
+    def stats(self):
+        return {"up": dict(self.uplink.stats), "down": dict(self.downlink.stats)}
+
+def parse_address(text, default_host="127.0.0.1"):
+    host, _, port = text.rpartition(":")
+    return (host or default_host, int(port))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="udp impairment proxy for the chat server")
+    parser.add_argument("--listen", default="127.0.0.1:5001", help="[host:]port clients connect to")
+    parser.add_argument("--server", default="127.0.0.1:5000", help="host:port of the real server")
+    parser.add_argument("--profile", default="clean", choices=sorted(profiles))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--loss", type=float, help="drop probability, overrides the profile")
+    parser.add_argument("--delay-ms", type=float, help="one way delay, overrides the profile")
+    parser.add_argument("--jitter-ms", type=float, help="delay varies by up to this much either way")
+    parser.add_argument("--reorder", type=float, help="probability a packet is held back behind later ones")
+    parser.add_argument("--duplicate", type=float, help="probability a packet is delivered twice")
+    parser.add_argument("--rate-kbps", type=float, help="bandwidth cap per direction, 0 = none")
+    return parser.parse_args()
+#main
+def main():
+    args = parse_args()
+    profile = build_profile(args.profile, loss=args.loss, delay_ms=args.delay_ms, jitter_ms=args.jitter_ms,
+                            reorder=args.reorder, duplicate=args.duplicate, rate_kbps=args.rate_kbps)
+    proxy = ImpairmentProxy(parse_address(args.listen), parse_address(args.server), profile, args.seed)
+    print(f"[Proxy] {proxy.listen_addr[0]}:{proxy.listen_addr[1]} -> {args.server} profile {args.profile} "
+          f"seed {args.seed} {profile}")
+    try:
+        proxy.run()
+    except KeyboardInterrupt:
+        print("\n[Proxy] Shutting down")
+    finally:
+        stats = proxy.stats()
+        proxy.stop()
+        for direction, counts in stats.items():
+            print(f"[Proxy] {direction}: " + ", ".join(f"{name} {count}" for name, count in counts.items()))
+
+if __name__ == "__main__":
+    main()
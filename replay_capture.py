@@ -0,0 +1,176 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+import chat_serverr_done as server
+from bench_load import git_commit
+from datagram_capture import read_capture
+
+# replays a trace recorded with the servers --capture option through the same handle_datagram the server runs,
+# so decoding, ordering, commands and fan-out see exactly the datagrams, addresses and order of the real run
+# everything the server sends goes to a null socket that only counts it, and the timers are run between datagrams
+# by default the trace goes through as fast as possible, --realtime keeps the gaps between datagrams (--speed scales them)
+# reports throughput and the time spent in each server stage, stages are timed for 1 in --sample calls and timing
+# every call costs a little, --sample 0 gives the cleanest throughput number
+# usage: python replay_capture.py trace.cap [--realtime] [--output after.json] [--compare before.json]
+
+# stands in for the server socket, nothing leaves the process
+class NullSocket:
+    def __init__(self):
+        self.packets = 0
+        self.bytes = 0
+
+    def sendto(self, data, addr):
+        self.packets += 1
+        self.bytes += len(data)
+        return len(data)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="replay a --capture trace through the server")
+    parser.add_argument("trace", help="file written by chat_serverr_done.py --capture")
+    parser.add_argument("--realtime", action="store_true", help="keep the gaps between datagrams")
+    parser.add_argument("--speed", type=float, default=1.0, help="with --realtime, play this many times faster")
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first this many datagrams")
+    parser.add_argument("--sample", type=int, default=1, help="time 1 in this many calls of every stage, 0 for none")
+    parser.add_argument("--timer-interval-ms", type=float, default=10, help="run the server timers this often")
+    parser.add_argument("--ack-every", type=int, default=server.ack_every)
+    parser.add_argument("--ack-delay-ms", type=float, default=server.ack_delay * 1000)
+    parser.add_argument("--idle-timeout", type=float, default=server.idle_timeout)
+    parser.add_argument("--compression", choices=["on", "off"], default="on")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the stage sampling")
+    parser.add_argument("--verbose", action="store_true", help="keep the servers console output")
+    parser.add_argument("--output", help="write the json result here")
+    parser.add_argument("--compare", help="earlier json result to compare against")
+    parser.add_argument("--max-regression", type=float, default=10.0,
+                        help="with --compare, exit with 1 if throughput drops by more than this percent")
+    return parser.parse_args(argv)
+
+def load_trace(path, limit):
+    records = []
+    for record in read_capture(path):
+        records.append(record)
+        if len(records) == limit:
+            break
+    return records
+# feeds every datagram to the server, returns the wall and cpu seconds it took
+def replay(records, sock, realtime, speed, timer_interval):
+    first = records[0][0] if records else 0.0
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    last_timers = start
+    for timestamp, addr, data in records:
+        now = time.perf_counter()
+        if realtime:
+            delay = (timestamp - first) / speed - (now - start)
+            if delay > 0:
+                time.sleep(delay)
+                now = time.perf_counter()
+        if now - last_timers >= timer_interval:
+            server.service_timers(sock)
+            last_timers = now
+        server.handle_datagram(data, addr)
+    server.service_timers(sock)
+    return time.perf_counter() - start, time.process_time() - cpu_start
+
+def stage_results(stats, seconds):
+    stages = {}
+    for stage, histogram in stats.stages.items():
+        if not histogram.count:
+            continue
+        stages[stage] = {
+            "calls_timed": histogram.count,
+            "mean_us": round(histogram.mean(), 2),
+            "p50_us": round(histogram.percentile(50), 2),
+            "p99_us": round(histogram.percentile(99), 2),
+            # the sampled time scaled back up to every call, as a share of the whole replay, recv contains the
+            # other stages and command contains fanout so the shares add up to more than 100%
+            "share": round(histogram.total * stats.sample_every / 1e6 / seconds, 4) if seconds else 0.0,
+        }
+    return stages
+
+def run_replay(config):
+    records = load_trace(config["trace"], config["limit"])
+    random.seed(config["seed"])
+    server.ack_every = max(1, config["ack_every"])
+    server.ack_delay = config["ack_delay_ms"] / 1000
+    server.idle_timeout = config["idle_timeout"]
+    server.compression_enabled = config["compression"] == "on"
+    server.stats.set_sampling(config["sample"])
+    sock = server.server_socket = NullSocket()
+
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(sys.stdout if config["verbose"] else devnull):
+            seconds, cpu_seconds = replay(records, sock, config["realtime"], config["speed"],
+                                          config["timer_interval_ms"] / 1000)
+    stats = server.stats
+    span = records[-1][0] - records[0][0] if records else 0.0
+    return {
+        "datagrams": len(records),
+        "bytes": sum(len(data) for _, _, data in records),
+        "clients": len({addr for _, addr, _ in records}),
+        "trace_seconds": round(span, 3),
+        "seconds": round(seconds, 3),
+        "cpu_seconds": round(cpu_seconds, 3),
+        "datagrams_per_s": round(len(records) / seconds) if seconds else 0,
+        "messages_per_s": round(stats.messages_delivered / seconds) if seconds else 0,
+        "us_per_datagram": round(seconds / len(records) * 1e6, 2) if records else 0.0,
+        "packets_sent": sock.packets,
+        "bytes_sent": sock.bytes,
+        "counters": {name: getattr(stats, name) for name in ("packets_received", "data_packets", "ack_packets",
+                                                              "duplicate_packets", "rejected_packets",
+                                                              "messages_delivered", "broadcasts",
+                                                              "fanout_recipients", "retransmissions")},
+        "stages": stage_results(stats, seconds),
+    }
+# prints how this replay moved against an earlier one, returns False if throughput got worse than allowed
+def compare_results(baseline, results, max_regression):
+    ok = True
+    old, new = baseline["datagrams_per_s"], results["datagrams_per_s"]
+    if old:
+        change = (new - old) / old * 100
+        flag = ""
+        if -change > max_regression:
+            flag = "  REGRESSION"
+            ok = False
+        print(f"{'datagrams_per_s':>22} {old:>10} -> {new:<10} {change:+.1f}%{flag}")
+    for stage, timing in results["stages"].items():
+        old = baseline["stages"].get(stage, {}).get("mean_us")
+        if old:
+            new = timing["mean_us"]
+            print(f"{stage + ' mean_us':>22} {old:>10} -> {new:<10} {(new - old) / old * 100:+.1f}%")
+    return ok
+
+def print_results(results):
+    print(f"{results['datagrams']} datagrams from {results['clients']} clients ({results['trace_seconds']}s of traffic) "
+          f"in {results['seconds']}s: {results['datagrams_per_s']} datagrams/s, {results['messages_per_s']} messages/s, "
+          f"{results['us_per_datagram']} us per datagram")
+    print(f"sent {results['packets_sent']} packets, {results['bytes_sent']} bytes to the null socket")
+    print(f"{'stage':>12} {'timed':>9} {'mean us':>9} {'p50 us':>9} {'p99 us':>9} {'share':>7}")
+    for stage, timing in results["stages"].items():
+        print(f"{stage:>12} {timing['calls_timed']:>9} {timing['mean_us']:>9} {timing['p50_us']:>9} "
+              f"{timing['p99_us']:>9} {timing['share']:>7.1%}")
+
+def main():
+    args = parse_args()
+    config = dict(vars(args))
+    output = config.pop("output")
+    for name in ("compare", "max_regression"):
+        config.pop(name)
+    results = run_replay(config)
+    print_results(results)
+    if output:
+        report = {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "config": config, "results": results}
+        with open(output, "w") as out_file:
+            out_file.write(json.dumps(report, indent=2) + "\n")
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if not compare_results(baseline["results"], results, args.max_regression):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
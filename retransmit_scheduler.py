@@ -0,0 +1,62 @@
+import heapq
+import itertools
+
+# min-heap of retransmit deadlines shared by the server and the client
+# cancel only marks the heap entry dead so an ack is O(1), dead entries get dropped when they reach the top
+class RetransmitScheduler:
+    def __init__(self):
+        self.heap = []
+        self.entries = {}
+        self.counter = itertools.count()
+        self.dead_entries = 0
+# (re)arms the timer for key, an existing timer for the same key is replaced
+    def schedule(self, key, deadline):
+        self.cancel(key)
+        entry = [deadline, next(self.counter), key, True]
+        self.entries[key] = entry
+        heapq.heappush(self.heap, entry)
+# stops the timer for key, does nothing if there isnt one
+    def cancel(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        entry[3] = False
+        self.dead_entries += 1
+        if self.dead_entries > 64 and self.dead_entries > len(self.entries):
+            self.compact()
+# returns the keys whose deadline has passed, only the expired entries are touched
+    def pop_expired(self, now):
+        expired = []
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            entry = heapq.heappop(heap)
+            if entry[3]:
+                del self.entries[entry[2]]
+                expired.append(entry[2])
+            else:
+                self.dead_entries -= 1
+        return expired
+# earliest live deadline or None when nothing is in flight
+    def next_deadline(self):
+        heap = self.heap
+        while heap and not heap[0][3]:
+            heapq.heappop(heap)
+            self.dead_entries -= 1
+        return heap[0][0] if heap else None
+# how long a polling loop can sleep before the next timer is due
+    def time_until_next(self, now, max_wait):
+        deadline = self.next_deadline()
+        if deadline is None:
+            return max_wait
+        return min(max_wait, max(0.0, deadline - now))
+# rebuilds the heap without cancelled entries once they outnumber the live ones
+    def compact(self):
+        self.heap = [entry for entry in self.heap if entry[3]]
+        heapq.heapify(self.heap)
+        self.dead_entries = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
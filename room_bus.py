@@ -0,0 +1,98 @@
+import json
+import os
+import socket
+import struct
+import threading
+import time
+
+# links the worker processes of a --workers server over unix domain sockets
+# every worker listens on <directory>/shard<n>.sock and opens one stream to every other worker,
+# events are json lists with a 4 byte length in front and arrive in the order one worker sent them
+FRAME = struct.Struct("!I")
+connect_timeout = 10.0
+
+class RoomBus:
+    def __init__(self, shard, shards, directory, handler):
+        self.shard = shard
+        self.shards = shards
+        self.directory = directory
+        # called as handler(from_shard, event) on the reader thread for that worker
+        self.handler = handler
+        self.listen_socket = None
+        # shard -> [socket, lock] for the streams we send on
+        self.peers = {}
+        self.events_sent = 0
+        self.events_received = 0
+
+    def path(self, shard):
+        return os.path.join(self.directory, f"shard{shard}.sock")
+# listens for the other workers and connects to all of them, returns once every stream is up
+    def start(self):
+        self.listen_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listen_socket.bind(self.path(self.shard))
+        self.listen_socket.listen(self.shards)
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+        deadline = time.time() + connect_timeout
+        for shard in range(self.shards):
+            if shard == self.shard:
+                continue
+            while True:
+                peer = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    peer.connect(self.path(shard))
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    # that worker has not bound its socket yet
+                    peer.close()
+                    if time.time() > deadline:
+                        raise
+                    time.sleep(0.05)
+            peer.sendall(FRAME.pack(self.shard))
+            self.peers[shard] = [peer, threading.Lock()]
+
+    def accept_loop(self):
+        while True:
+            try:
+                conn, _ = self.listen_socket.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.read_loop, args=(conn,), daemon=True).start()
+
+    def read_loop(self, conn):
+        with conn, conn.makefile("rb") as stream:
+            header = stream.read(FRAME.size)
+            if len(header) < FRAME.size:
+                return
+            from_shard = FRAME.unpack(header)[0]
+            while True:
+                header = stream.read(FRAME.size)
+                if len(header) < FRAME.size:
+                    return
+                body = stream.read(FRAME.unpack(header)[0])
+                self.events_received += 1
+                self.handler(from_shard, json.loads(body))
+# sends an event to the given workers, every other worker when shards is None
+    def publish(self, event, shards=None):
+        data = json.dumps(event, separators=(",", ":")).encode()
+        frame = FRAME.pack(len(data)) + data
+        for shard in (self.peers if shards is None else shards):
+            entry = self.peers.get(shard)
+            if entry is None:
+                continue
+            with entry[1]:
+                try:
+                    entry[0].sendall(frame)
+                except OSError as e:
+                    print(f"[Bus] lost worker {shard}:", e)
+                    continue
+            self.events_sent += 1
+
+    def close(self):
+        for peer, _ in self.peers.values():
+            peer.close()
+        if self.listen_socket is not None:
+            self.listen_socket.close()
+            try:
+                os.unlink(self.path(self.shard))
+            except OSError:
+                pass
@@ -0,0 +1,269 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+# what was said in each room, kept on disk as an append only log so it can be replayed to clients that join later
+# every room has a directory of segment files, each one made at its full size and memory mapped, records are
+# appended one after the other as time + length + the message bytes and the rest of the file stays zero
+# the only thing kept in memory per message is its offset in an array, replay slices the bytes out of the map
+RECORD = struct.Struct("!dI")
+
+# one mapped segment file and the offsets of the records in it
+class Segment:
+    __slots__ = ("path", "mm", "offsets", "size")
+
+    def __init__(self, path, capacity=None):
+        self.path = path
+        if capacity is not None:
+            with open(path, "wb") as f:
+                f.truncate(capacity)
+        with open(path, "r+b") as f:
+            # the map keeps its own handle on the file
+            self.mm = mmap.mmap(f.fileno(), 0)
+        self.offsets = array("I")
+        self.size = 0
+        if capacity is None:
+            self.scan()
+# finds the records in a segment left by an earlier run, a zero length marks the end of what was written
+    def scan(self):
+        mm = self.mm
+        offset = 0
+        while offset + RECORD.size <= len(mm):
+            _, length = RECORD.unpack_from(mm, offset)
+            end = offset + RECORD.size + length
+            if length == 0 or end > len(mm):
+                break
+            self.offsets.append(offset)
+            offset = end
+        self.size = offset
+
+    def fits(self, length):
+        return self.size + RECORD.size + length <= len(self.mm)
+# the message goes in before its header, a record cut short by a crash still has length 0 and ends the segment
+    def append(self, data, now):
+        offset = self.size
+        start = offset + RECORD.size
+        self.mm[start:start + len(data)] = data
+        RECORD.pack_into(self.mm, offset, now, len(data))
+        self.offsets.append(offset)
+        self.size = start + len(data)
+
+    def record_time(self, index):
+        return RECORD.unpack_from(self.mm, self.offsets[index])[0]
+
+    def record(self, index):
+        offset = self.offsets[index]
+        _, length = RECORD.unpack_from(self.mm, offset)
+        start = offset + RECORD.size
+        return self.mm[start:start + length]
+
+    def last_time(self):
+        return self.record_time(len(self.offsets) - 1) if self.offsets else 0.0
+
+    def close(self):
+        self.mm.close()
+
+# the segments of one room, oldest first, appends always go to the last one
+class RoomLog:
+    def __init__(self, directory, segment_bytes):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # segment files are numbered so the names sort in the order they were written, anything else is not ours
+        names = sorted(name for name in os.listdir(directory) if is_segment_name(name))
+        self.segments = [Segment(os.path.join(directory, name)) for name in names]
+        self.next_number = int(names[-1][:-4], 16) + 1 if names else 0
+        # set once RoomHistory closed the log to free its maps, whoever still has it has to open it again
+        self.closed = False
+
+    def bytes_on_disk(self):
+        return sum(len(segment.mm) for segment in self.segments)
+# caller holds the lock
+    def append(self, data, now):
+        if not self.segments or not self.segments[-1].fits(len(data)):
+            # a message bigger than a whole segment gets a segment of its own
+            capacity = max(self.segment_bytes, RECORD.size + len(data))
+            path = os.path.join(self.directory, f"{self.next_number:08x}.log")
+            self.next_number += 1
+            self.segments.append(Segment(path, capacity))
+        self.segments[-1].append(data, now)
+# drops the oldest segments while the room is over max_bytes or their newest record is older than oldest,
+# the segment being written to stays unless keep_active is off and all of it has expired, caller holds the lock
+    def trim(self, max_bytes, oldest, keep_active=True):
+        total = self.bytes_on_disk()
+        while self.segments:
+            segment = self.segments[0]
+            expired = segment.last_time() < oldest
+            if len(self.segments) == 1 and (keep_active or not expired):
+                break
+            if total <= max_bytes and not expired:
+                break
+            total -= len(segment.mm)
+            self.segments.pop(0)
+            segment.close()
+            os.unlink(segment.path)
+# the newest limit records written at or after since, oldest first, caller holds the lock
+    def replay(self, limit, since):
+        picked = []
+        for segment in reversed(self.segments):
+            index = len(segment.offsets) - 1
+            while index >= 0 and len(picked) < limit:
+                if segment.record_time(index) < since:
+                    break
+                picked.append((segment, index))
+                index -= 1
+            if index >= 0:
+                break
+        return [segment.record(index) for segment, index in reversed(picked)]
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+        self.closed = True
+
+# a segment file name is eight hex digits and .log
+def is_segment_name(name):
+    digits = name[:-4]
+    return name.endswith(".log") and len(digits) == 8 and all(c in "0123456789abcdef" for c in digits)
+# the room a directory name stands for, None for stray files and directories like the workerN ones
+# a --workers run leaves behind
+def room_from_path(name):
+    try:
+        return bytes.fromhex(name).decode()
+    except ValueError:
+        return None
+
+# every rooms log under one directory, retention is max_bytes per room and max_age seconds for every record
+# every mapped segment holds a file descriptor, so at most max_open of them stay mapped: the logs used longest
+# ago are closed first and read back from disk the next time their room is used
+# lock order is logs_lock -> a logs lock, nothing takes logs_lock while it holds a logs lock
+class RoomHistory:
+    def __init__(self, directory, segment_bytes=1 << 20, max_bytes=16 << 20, max_age=86400.0, max_open=128):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max(max_bytes, segment_bytes)
+        self.max_age = max_age
+        self.max_open = max_open
+        # room name -> open RoomLog, least recently used first
+        self.logs = OrderedDict()
+        self.logs_lock = threading.Lock()
+        # every room with a log on disk, open or not, rooms from an earlier run are only opened when used
+        self.rooms = set()
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            room_name = room_from_path(name)
+            if room_name is not None and os.path.isdir(os.path.join(directory, name)):
+                self.rooms.add(room_name)
+# the open log for one room with its lock held, opened or made the first time the room is used,
+# room names become hex so any name is a safe path, close_others=False leaves the other open logs alone
+    def lock_log(self, room_name, close_others=True):
+        while True:
+            opened = False
+            with self.logs_lock:
+                log = self.logs.get(room_name)
+                if log is None:
+                    path = os.path.join(self.directory, room_name.encode().hex())
+                    log = self.logs[room_name] = RoomLog(path, self.segment_bytes)
+                    self.rooms.add(room_name)
+                    opened = True
+                else:
+                    self.logs.move_to_end(room_name)
+            if opened and close_others:
+                self.close_idle(room_name)
+            log.lock.acquire()
+            if not log.closed:
+                return log
+            log.lock.release()
+# closes the least recently used logs until no more than max_open segments are mapped, keep stays open
+    def close_idle(self, keep):
+        with self.logs_lock:
+            mapped = sum(len(log.segments) for log in self.logs.values())
+            for room_name in list(self.logs):
+                if mapped <= self.max_open:
+                    break
+                if room_name == keep:
+                    continue
+                log = self.logs.pop(room_name)
+                with log.lock:
+                    mapped -= len(log.segments)
+                    log.close()
+
+    def append(self, room_name, message, now=None):
+        now = time.time() if now is None else now
+        data = message.encode() if isinstance(message, str) else message
+        log = self.lock_log(room_name)
+        try:
+            count = len(log.segments)
+            log.append(data, now)
+            started = len(log.segments) != count
+            if started:
+                # retention only needs a look when a new segment was started
+                log.trim(self.max_bytes, now - self.max_age)
+        finally:
+            log.lock.release()
+        if started:
+            self.close_idle(room_name)
+# retention for every room, run from the servers timer so a room that went quiet still loses its old records:
+# expired segments are deleted, the one being written to too once all of it has expired, and a room with nothing
+# left is removed with its directory, logs the sweep had to open are closed again, returns the rooms removed
+    def expire(self, now=None):
+        now = time.time() if now is None else now
+        oldest = now - self.max_age
+        removed = 0
+        for room_name in list(self.rooms):
+            with self.logs_lock:
+                was_open = room_name in self.logs
+            # a log opened just for the sweep is closed again right after, so it does not push out the ones in use
+            log = self.lock_log(room_name, close_others=was_open)
+            try:
+                log.trim(self.max_bytes, oldest, keep_active=False)
+                empty = not log.segments
+            finally:
+                log.lock.release()
+            if empty or not was_open:
+                removed += self.release_log(room_name, log)
+        return removed
+# closes a log, and removes the room if no segment is left, unless someone appended in the meantime
+# returns 1 when the room was removed
+    def release_log(self, room_name, log):
+        with self.logs_lock:
+            if self.logs.get(room_name) is not log:
+                return 0
+            del self.logs[room_name]
+            with log.lock:
+                empty = not log.segments
+                log.close()
+            if not empty:
+                return 0
+            self.rooms.discard(room_name)
+            try:
+                os.rmdir(log.directory)
+            except OSError:
+                # something that is not a segment is in there, the directory stays
+                pass
+            return 1
+# the newest limit messages of the room written at or after since, as bytes, oldest first
+    def replay(self, room_name, limit, since=0.0, now=None):
+        if room_name not in self.rooms or limit <= 0:
+            return []
+        now = time.time() if now is None else now
+        oldest = now - self.max_age
+        log = self.lock_log(room_name)
+        try:
+            log.trim(self.max_bytes, oldest)
+            return log.replay(limit, max(since, oldest))
+        finally:
+            log.lock.release()
+
+    def close(self):
+        with self.logs_lock:
+            for log in self.logs.values():
+                with log.lock:
+                    log.close()
+            self.logs = OrderedDict()
@@ -0,0 +1,138 @@
+from chat_protocol import SEQ_MASK
+
+# the sliding windows, the send side is a ring buffer (slot = seq & mask so lookups and inserts are a list index)
+# and the receive side a dict, both refuse anything past size packets
+# sequence numbers are plain ints inside the program and only 32 bits on the wire, unwrap_seq turns a wire
+# value back into the full number closest to where the window is, so a stream can run past 2**32
+SEQ_HALF = (SEQ_MASK + 1) // 2
+
+# the full sequence number that wire_seq stands for, the one within 2**31 of reference
+def unwrap_seq(wire_seq, reference):
+    return reference + ((wire_seq - reference + SEQ_HALF) & SEQ_MASK) - SEQ_HALF
+# the ring holds at least size slots, rounded up to a power of two so seq & mask never jumps at a wrap
+def ring_size(size):
+    slots = 1
+    while slots < size:
+        slots <<= 1
+    return slots
+
+# receive side: packets from expected up to expected + size - 1 are accepted, anything past that is refused
+# so a peer can never make us buffer more than size packets
+# the buffer is a dict, a stream that arrives in order only ever holds the packet being handed out and an idle
+# session holds an empty dict instead of a ring, and the dict is the faster of the two here (bench_seq_window.py)
+class ReceiveWindow:
+    __slots__ = ("size", "expected", "buffered")
+
+    def __init__(self, size):
+        self.size = size
+        # the next sequence number to hand out in order
+        self.expected = 0
+        # seq -> item for packets that arrived and were not handed out yet
+        self.buffered = {}
+# stores an item, returns False for anything old, already buffered or outside the window
+    def offer(self, seq_num, item):
+        if not self.expected <= seq_num < self.expected + self.size or seq_num in self.buffered:
+            return False
+        self.buffered[seq_num] = item
+        return True
+# the next in order item or None if it has not arrived yet
+    def pop(self):
+        item = self.buffered.pop(self.expected, None)
+        if item is not None:
+            self.expected += 1
+        return item
+
+    def __contains__(self, seq_num):
+        return seq_num in self.buffered
+# first sequence number that has not arrived, what a cumulative ack carries
+    def next_missing(self):
+        seq_num = self.expected
+        while seq_num in self.buffered:
+            seq_num += 1
+        return seq_num
+# sack bitmap past next_expected up to the end of the window, bit i means next_expected + 1 + i is buffered
+    def sack_bits(self, next_expected):
+        bits = 0
+        for seq_num in self.buffered:
+            offset = seq_num - next_expected - 1
+            if offset >= 0:
+                bits |= 1 << offset
+        return bits
+
+# send side: base is the oldest packet not acked yet and next_seq the number the next packet gets,
+# a packet can only be added while next_seq - base < size so a slot is never reused before it is acked
+# the ring is only there while something is in flight, the first add makes it and it is dropped once
+# everything is acked, so an idle session does not carry one
+class SendWindow:
+    __slots__ = ("size", "mask", "slots", "base", "next_seq", "count")
+
+    def __init__(self, size):
+        self.size = size
+        self.mask = ring_size(size) - 1
+        self.slots = None
+        self.base = 0
+        self.next_seq = 0
+        # packets in the window that are not acked yet, selectively acked ones are already gone
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, seq_num):
+        return self.base <= seq_num < self.next_seq and self.slots[seq_num & self.mask] is not None
+# how many more packets fit before the oldest unacked one blocks the ring
+    def room(self):
+        return self.size - (self.next_seq - self.base)
+# puts an entry in the next slot and returns its sequence number, caller checks room() first
+    def add(self, entry):
+        if self.slots is None:
+            self.slots = [None] * (self.mask + 1)
+        seq_num = self.next_seq
+        self.slots[seq_num & self.mask] = entry
+        self.next_seq += 1
+        self.count += 1
+        return seq_num
+
+    def get(self, seq_num):
+        if self.base <= seq_num < self.next_seq:
+            return self.slots[seq_num & self.mask]
+        return None
+# replaces the entry of a packet that is still in the window, e.g. after a retransmit
+    def update(self, seq_num, entry):
+        self.slots[seq_num & self.mask] = entry
+# takes one acked packet out, returns its entry or None if it was not in the window
+    def remove(self, seq_num):
+        entry = self.get(seq_num)
+        if entry is None:
+            return None
+        self.slots[seq_num & self.mask] = None
+        self.count -= 1
+        self.advance()
+        return entry
+# cumulative ack: takes out everything below next_expected, returns the (seq, entry) pairs that were still there
+    def release_below(self, next_expected):
+        released = []
+        end = min(next_expected, self.next_seq)
+        while self.base < end:
+            index = self.base & self.mask
+            entry = self.slots[index]
+            if entry is not None:
+                released.append((self.base, entry))
+                self.slots[index] = None
+                self.count -= 1
+            self.base += 1
+        self.advance()
+        return released
+# moves base past packets that were selectively acked, base reaches next_seq once nothing is left in flight
+    def advance(self):
+        if not self.count:
+            self.base = self.next_seq
+            self.slots = None
+            return
+        while self.slots[self.base & self.mask] is None:
+            self.base += 1
+# sequence numbers still waiting for an ack, oldest first
+    def __iter__(self):
+        for seq_num in range(self.base, self.next_seq):
+            if self.slots[seq_num & self.mask] is not None:
+                yield seq_num
@@ -0,0 +1,132 @@
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from chat_metrics import LatencyHistogram
+
+# live counters and per stage timings for the server, read over http while it runs
+# counters are bare attribute increments with no lock, a lost increment when two receive threads race is the price
+# of keeping them off the hot path, stage timings are taken for a random 1 in sample_every calls, random so a
+# stage that runs in a fixed pattern (a message, then an empty buffer) is not always sampled at the same step,
+# with sampling off a hook costs one attribute check
+STAGES = ("recv", "decode", "ordering", "command", "fanout", "retransmit")
+# name -> help text, all of them only ever go up
+COUNTERS = {
+    "datagrams_received": "datagrams read from the socket",
+    "bytes_received": "bytes read from the socket",
+    "packets_received": "packets decoded, a batch datagram counts once per packet inside it",
+    "data_packets": "data packets from clients",
+    "ack_packets": "ack packets from clients",
+    "duplicate_packets": "data packets that were already acked or buffered",
+    "rejected_packets": "data packets past the receive window",
+    "messages_delivered": "messages run as commands, in order",
+    "broadcasts": "room broadcasts",
+    "fanout_recipients": "clients a broadcast was queued for",
+    "packets_sent": "packets sent to binary clients, before batching",
+    "bytes_sent": "bytes of those packets, headers included",
+    "acks_sent": "cumulative acks sent",
+    "retransmissions": "packets sent again after their timer ran out",
+    "outbound_dropped": "queued messages dropped because a client fell behind",
+    "clients_expired": "sessions dropped by the idle sweep",
+    "resets_sent": "packets from addresses without a session answered with a reset",
+    "history_errors": "room history appends, replays or retention sweeps that failed with an os error",
+    "decompress_errors": "compressed payloads that did not inflate or came from a client without compression",
+}
+
+class ServerStats:
+    __slots__ = tuple(COUNTERS) + ("stages", "sample_every")
+
+    def __init__(self, sample_every=0):
+        for name in COUNTERS:
+            setattr(self, name, 0)
+        # stage -> histogram of sampled durations in microseconds
+        self.stages = {stage: LatencyHistogram() for stage in STAGES}
+        # time 1 in this many stage calls, 0 turns timing off
+        self.sample_every = sample_every
+# call at the start of a stage, returns 0 when this call is not sampled
+    def start(self):
+        if not self.sample_every:
+            return 0
+        if random.random() * self.sample_every >= 1:
+            return 0
+        return time.perf_counter()
+# call at the end with whatever start returned
+    def stop(self, stage, started):
+        if started:
+            self.stages[stage].record((time.perf_counter() - started) * 1e6)
+
+    def set_sampling(self, sample_every):
+        self.sample_every = max(0, sample_every)
+        # new timings should not be mixed with ones taken at another rate
+        self.stages = {stage: LatencyHistogram() for stage in STAGES}
+
+# the counters, the gauges the server passes in and the stage timings as prometheus text
+def render_prometheus(stats, gauges, prefix="chat"):
+    lines = []
+    for name, text in COUNTERS.items():
+        lines.append(f"# HELP {prefix}_{name}_total {text}")
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {getattr(stats, name)}")
+    for name, (text, value) in gauges.items():
+        lines.append(f"# HELP {prefix}_{name} {text}")
+        lines.append(f"# TYPE {prefix}_{name} gauge")
+        lines.append(f"{prefix}_{name} {value}")
+    lines.append(f"# HELP {prefix}_stage_seconds time spent in each server stage, sampled 1 in {prefix}_stats_sample_every calls")
+    lines.append(f"# TYPE {prefix}_stage_seconds summary")
+    for stage, histogram in stats.stages.items():
+        for quantile in (0.5, 0.9, 0.99, 0.999):
+            value = histogram.percentile(quantile * 100) / 1e6
+            lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="{quantile}"}} {value:.9f}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram.total / 1e6:.9f}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+    lines.append(f"# HELP {prefix}_stats_sample_every stage timing rate, 0 is off")
+    lines.append(f"# TYPE {prefix}_stats_sample_every gauge")
+    lines.append(f"{prefix}_stats_sample_every {stats.sample_every}")
+    return "\n".join(lines) + "\n"
+
+# serves GET /metrics, GET /sample?every=N changes the stage timing rate without a restart
+# gauges is called on every scrape and returns name -> (help, value)
+class StatsServer:
+    def __init__(self, host, port, stats, gauges):
+        self.stats = stats
+        self.gauges = gauges
+        self.httpd = ThreadingHTTPServer((host, port), self.handler_class())
+        self.httpd.daemon_threads = True
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/metrics":
+                    body = render_prometheus(server.stats, server.gauges())
+                elif url.path == "/sample":
+                    try:
+                        server.stats.set_sampling(int(parse_qs(url.query).get("every", ["0"])[0]))
+                    except ValueError:
+                        self.send_error(400, "every must be a number")
+                        return
+                    body = f"sampling 1 in {server.stats.sample_every}\n"
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+# scrapes are not worth a line on the server console
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()